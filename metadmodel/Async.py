@@ -0,0 +1,242 @@
+"""
+Defines an AsyncRun class for running simulations from an asyncio event loop.
+
+Copyright (C) 2017 Thomas John Heavey IV
+
+This program is free software: you can redistribute it and/or modify it under the terms of the
+GNU General Public License as published by the Free Software Foundation, either version 3 of
+the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with this program. If
+not, see http://www.gnu.org/licenses/.
+"""
+
+import asyncio
+import copy
+import math
+import random
+import numpy as np
+from typing import AsyncIterator, Iterable, List, Optional
+
+
+def _seed(seed: int) -> None:
+    """Seed the random number generators (in a worker)"""
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def _metad_block(simulation, steps: int, seed: int):
+    """
+    Run a block of steps of a Simulation (in a worker)
+
+    :param Simulation.Simulation simulation: copy of the simulation to continue
+    :param steps: number of steps to run
+    :param seed: seed for the random number generators
+    :return: the simulation, with only this block's frames
+    """
+    _seed(seed)
+    simulation.run(steps, status_int=steps + 1, verbose=False)
+    return simulation
+
+
+def _remd_block(simulation, start: int, stop: int, seed: int) -> tuple:
+    """
+    Run a block of steps of a remd_model Simulation (in a worker)
+
+    :param remd_model.Simulation simulation: simulation without its arrays
+    :param start: first step
+    :param stop: step after the last
+    :param seed: seed for the random number generators
+    :return: the System and the energies, w_states and r_states of the block
+    """
+    _seed(seed)
+    return (simulation.system,) + tuple(simulation.run_steps(start, stop))
+
+
+class AsyncRun(object):
+    """
+    Run a Simulation (from this package or remd_model) as a series of step blocks
+    on an executor, so that it can be awaited from an event loop
+
+        run = AsyncRun(simulation, 100000, executor=pool)
+        task = asyncio.ensure_future(run.run())
+        async for steps_done in run.progress():
+            ...
+        simulation = await task
+
+    Each block is handed to the executor (the loop's default thread pool if none
+    is given) and the loop is free in between. With a ProcessPoolExecutor the
+    state needed to continue the run (the Particle and its FES, or the remd_model
+    System) is pickled to a worker and back for every block, along with only that
+    block's frames. The FES functions must then be picklable, as those from the
+    Potentials module are (autograd derivatives are not, so give a deriv).
+
+    Blocks are run quietly: the Simulation does not print its progress or energy
+    drift for each block (see Simulation.energy_drift for the drift of the run).
+
+    Cancelling the task running run() stops it from starting another block; the
+    block already in the executor runs to completion but is discarded.
+
+    The random number generators (random and numpy.random) are seeded in the
+    worker before each block, with seeds spawned from the seed of the run, so
+    that concurrent runs in forked workers do not draw the same numbers. Runs are
+    reproducible for a given seed, unless another run shares those generators
+    at the same time (as in a thread pool).
+
+    For a metadynamics Simulation the block size is rounded up to a multiple of the
+    stride and metad_freq, so that frames and hills fall on the same steps as in
+    one run; the Simulation returned by run() has all the frames and hill steps.
+    """
+
+    def __init__(self, simulation, steps: int=None, block_size: int=10000,
+                 executor=None, seed: int=None):
+        """
+
+        :param simulation: Simulation.Simulation (with a Particle) or
+        remd_model.Simulation to run
+        :param steps: number of steps to run (required for a metadynamics
+        Simulation; for remd_model, default is its n_steps)
+        :param block_size: number of steps per block
+        :param concurrent.futures.Executor executor: executor for the blocks
+        :param seed: seed from which the seeds of the blocks are spawned (default:
+        fresh entropy, different for every run)
+        """
+        self._simulation = simulation
+        self._remd = hasattr(simulation, 'run_steps')
+        if self._remd:
+            steps = simulation.n_steps if steps is None else steps
+            if steps > simulation.n_steps:
+                raise ValueError(f'Can only run up to {simulation.n_steps} steps')
+        else:
+            if steps is None:
+                raise ValueError('The number of steps must be given for a '
+                                 'metadynamics Simulation')
+            multiple = simulation.stride * simulation.metad_freq // math.gcd(
+                simulation.stride, simulation.metad_freq)
+            block_size = -(-block_size // multiple) * multiple
+        self._steps = int(steps)
+        self._block_size = int(block_size)
+        self._executor = executor
+        self._seeds = np.random.SeedSequence(seed)
+        self._steps_done = 0
+        self._finished = False
+        self._listeners: List[asyncio.Queue] = []
+
+    @property
+    def steps_done(self) -> int:
+        """Number of steps of the completed blocks"""
+        return self._steps_done
+
+    @property
+    def finished(self) -> bool:
+        """Whether run() has returned (or was cancelled or failed)"""
+        return self._finished
+
+    def _block_seed(self) -> int:
+        """Seed for the next block"""
+        return int(self._seeds.spawn(1)[0].generate_state(1)[0])
+
+    def _notify(self, steps_done: Optional[int]) -> None:
+        """Send a progress update (None when done) to every progress iterator"""
+        for queue in self._listeners:
+            queue.put_nowait(steps_done)
+
+    async def run(self):
+        """
+        Run the simulation
+
+        :return: the finished simulation (for a metadynamics Simulation, a copy
+        of the given one, sharing its Particle unless a process pool was used)
+        """
+        if self._steps_done or self._finished:
+            raise RuntimeError('This run has already been started')
+        loop = asyncio.get_running_loop()
+        try:
+            if self._remd:
+                return await self._run_remd(loop)
+            return await self._run_metad(loop)
+        finally:
+            self._finished = True
+            self._notify(None)
+
+    async def _run_metad(self, loop):
+        """Run the blocks of a metadynamics Simulation"""
+        result = None
+        block_sim = self._simulation
+        while self._steps_done < self._steps:
+            steps = min(self._block_size, self._steps - self._steps_done)
+            block_sim = await loop.run_in_executor(
+                self._executor, _metad_block, copy.copy(block_sim), steps,
+                self._block_seed())
+            if result is None:
+                result = block_sim
+            else:
+                result.extend(block_sim)
+            self._steps_done += steps
+            self._notify(self._steps_done)
+        return result
+
+    async def _run_remd(self, loop):
+        """Run the blocks of a remd_model Simulation, filling in its arrays"""
+        simulation = self._simulation
+        while self._steps_done < self._steps:
+            start = self._steps_done
+            stop = min(start + self._block_size, self._steps)
+            light = copy.copy(simulation)
+            light.energies = light.w_states = light.r_states = None
+            (simulation.system, simulation.energies[start:stop],
+             simulation.w_states[start:stop], simulation.r_states[start:stop]) = \
+                await loop.run_in_executor(self._executor, _remd_block, light,
+                                           start, stop, self._block_seed())
+            self._steps_done = stop
+            self._notify(self._steps_done)
+        return simulation
+
+    async def progress(self) -> AsyncIterator[int]:
+        """
+        Iterate over the number of steps done as each block completes
+
+        Ends when the run is finished (including if it is cancelled or fails).
+        """
+        if self._finished:
+            return
+        queue = asyncio.Queue()
+        self._listeners.append(queue)
+        try:
+            while True:
+                steps_done = await queue.get()
+                if steps_done is None:
+                    return
+                yield steps_done
+        finally:
+            self._listeners.remove(queue)
+
+
+async def run_many(runs: Iterable[AsyncRun], max_concurrent: int=None,
+                   return_exceptions: bool=False) -> list:
+    """
+    Run many AsyncRuns, with at most max_concurrent of them going at once
+
+    Runs waiting for a slot have not started, so they cost nothing but their
+    Simulation. If this is cancelled, so are all of the runs.
+
+    :param runs: the runs
+    :param max_concurrent: maximum number of runs going at once (default: no
+    limit other than the executors')
+    :param return_exceptions: give the errors of failed runs in the results
+    instead of raising the first one
+    :return: the result of each run() in order
+    """
+    runs = list(runs)
+    limit = asyncio.Semaphore(max_concurrent or len(runs) or 1)
+
+    async def _limited(run: AsyncRun):
+        async with limit:
+            return await run.run()
+
+    return await asyncio.gather(*(_limited(run) for run in runs),
+                                return_exceptions=return_exceptions)
@@ -0,0 +1,180 @@
+"""
+Defines a BackgroundRun class for running a Simulation while watching it.
+
+Copyright (C) 2017 Thomas John Heavey IV
+
+This program is free software: you can redistribute it and/or modify it under the terms of the
+GNU General Public License as published by the Free Software Foundation, either version 3 of
+the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with this program. If
+not, see http://www.gnu.org/licenses/.
+"""
+
+import threading
+import numpy as np
+from typing import NamedTuple, Optional, Tuple
+
+from . import FES
+
+
+class Snapshot(NamedTuple):
+    """State of a running simulation, copied for the reader"""
+    step: int
+    n_hills: int
+    grid: Optional[Tuple[np.ndarray, ...]]
+    bias: Optional[np.ndarray]
+    positions: np.ndarray
+
+
+class _Buffer(object):
+    """
+    One of the two preallocated buffers that snapshots are written into
+
+    version is odd while the buffer is being written, and changes every time it is
+    written, so a reader can tell whether its copy may be torn.
+    """
+
+    def __init__(self, bias_shape: Optional[tuple], window: int, dimension: int):
+        self.version = 0
+        self.step = 0
+        self.n_hills = 0
+        self.bias = None if bias_shape is None else np.zeros(bias_shape)
+        self.positions = np.zeros((window, dimension))
+        self.n_positions = 0
+
+
+class BackgroundRun(object):
+    """
+    Run a Simulation in a background thread and publish snapshots of it
+
+    Every publish_int steps the integrator writes the step, number of hills, bias
+    on its grid (for a MetadFES1D with an analysis grid, or a MetadFES2D) and the
+    most recent window of positions into whichever of two buffers readers are not
+    pointed at, then switches them over. The integrator never waits on a lock or on
+    readers; snapshot() copies the current buffer and simply tries again in the
+    rare case that it was overwritten while being copied.
+
+    Note that the thread shares the interpreter with the caller, so heavy work in
+    the calling thread slows the simulation down.
+    """
+
+    def __init__(self, simulation, steps: int, publish_int: int=1000,
+                 window: int=1000, status_int: int=None):
+        """
+
+        :param Simulation.Simulation simulation: simulation to run (with a Particle)
+        :param steps: number of steps to run
+        :param publish_int: number of steps between published snapshots
+        :param window: number of most recent frames of positions in snapshots
+        :param status_int: number of steps between printed progress reports
+        (default: none)
+        """
+        self._simulation = simulation
+        self._steps = int(steps)
+        self._publish_int = int(publish_int)
+        self._status_int = status_int or self._steps + 1
+        fes = simulation.particle.fes
+        self._fes = fes
+        self._grid = None
+        self._grid_bias = None
+        if isinstance(fes, FES.MetadFES2D):
+            self._grid = fes.grid
+            self._grid_bias = fes.bias_grid
+        elif isinstance(fes, FES.MetadFES1D):
+            try:
+                self._grid = (fes.analysis_grid,)
+                self._grid_bias = fes.analysis_bias
+            except AttributeError:
+                pass  # no analysis grid, so no bias in the snapshots
+        bias_shape = None if self._grid_bias is None else self._grid_bias.shape
+        self._buffers = [_Buffer(bias_shape, window, fes.dimensionality)
+                         for _ in range(2)]
+        self._current = 0
+        self._thread: threading.Thread = None
+        self._error: BaseException = None
+
+    def start(self) -> 'BackgroundRun':
+        """
+        Start running the simulation in a background thread
+
+        :return: self
+        """
+        if self._thread is not None:
+            raise RuntimeError('This run has already been started')
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        """Run the simulation (in the background thread), keeping any error"""
+        try:
+            self._simulation.run(self._steps, status_int=self._status_int,
+                                 callback=self._publish,
+                                 callback_int=self._publish_int)
+            if self._steps % self._publish_int:
+                self._publish(self._steps)
+        except BaseException as error:
+            self._error = error
+
+    def _publish(self, step: int) -> None:
+        """
+        Write the current state into the buffer readers are not using and swap
+
+        :param step: current step number
+        :return: None
+        """
+        buffer = self._buffers[1 - self._current]
+        buffer.version += 1
+        buffer.step = step
+        buffer.n_hills = self._fes.n_hills
+        if buffer.bias is not None:
+            buffer.bias[...] = self._grid_bias
+        frame = step // self._simulation.stride
+        start = max(0, frame + 1 - len(buffer.positions))
+        buffer.n_positions = frame + 1 - start
+        buffer.positions[:buffer.n_positions] = \
+            self._simulation.records['position'][start:frame + 1]
+        buffer.version += 1
+        self._current = 1 - self._current
+
+    def snapshot(self) -> Optional[Snapshot]:
+        """
+        Copy of the most recently published state of the simulation
+
+        :return: the snapshot, or None if nothing has been published yet
+        """
+        while True:
+            buffer = self._buffers[self._current]
+            version = buffer.version
+            if version == 0:
+                return None
+            if version % 2:
+                continue
+            bias = None if buffer.bias is None else buffer.bias.copy()
+            positions = buffer.positions[:buffer.n_positions].copy()
+            snapshot = Snapshot(step=buffer.step, n_hills=buffer.n_hills,
+                                grid=self._grid, bias=bias, positions=positions)
+            if buffer.version == version:
+                return snapshot
+
+    @property
+    def running(self) -> bool:
+        """Whether the simulation is still running"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def join(self, timeout: float=None) -> None:
+        """
+        Wait for the simulation to finish
+
+        :param timeout: maximum time to wait in seconds
+        :return: None
+        :raises: any error raised by the simulation
+        """
+        self._thread.join(timeout)
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,188 @@
+"""
+Defines schedulers for adding metadynamics hills less often or with varying heights.
+
+A scheduler is given to a Simulation, which asks it every metad_freq steps whether
+to add a hill and how tall:
+
+    sim = Simulation.Simulation(particle=particle, metad_freq=5,
+                                scheduler=Deposition.BiasGated(level=4.))
+
+Adding a hill every metad_freq steps (no scheduler) is the reference, so each
+scheduler counts the hills it saved against it.
+
+Copyright (C) 2017 Thomas John Heavey IV
+
+This program is free software: you can redistribute it and/or modify it under the terms of the
+GNU General Public License as published by the Free Software Foundation, either version 3 of
+the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with this program. If
+not, see http://www.gnu.org/licenses/.
+"""
+
+import math
+import numpy as np
+from typing import Optional, Sequence
+
+
+class Scheduler(object):
+    """
+    Add every hill at the height of the FES (the same as no scheduler)
+
+    Subclasses decide otherwise by overriding _height.
+    """
+
+    def __init__(self):
+        self._n_considered = 0
+        self._n_added = 0
+
+    def consider(self, particle) -> Optional[float]:
+        """
+        Decide whether to add a hill where the particle is now
+
+        :param Particle.Particle particle: the particle
+        :return: height of the hill to add, or None to not add one
+        """
+        height = self._height(particle)
+        self._n_considered += 1
+        if height is not None:
+            self._n_added += 1
+        return height
+
+    def _height(self, particle) -> Optional[float]:
+        """Height of the hill to add, or None to not add one"""
+        return particle.fes.height
+
+    @property
+    def n_considered(self) -> int:
+        """Number of hills considered (those a fixed stride would have added)"""
+        return self._n_considered
+
+    @property
+    def n_added(self) -> int:
+        """Number of hills added"""
+        return self._n_added
+
+    @property
+    def hills_saved(self) -> int:
+        """Number of hills not added that a fixed stride would have added"""
+        return self._n_considered - self._n_added
+
+    def report(self) -> str:
+        """Summary of the hills added and saved"""
+        percent = 100. * self.hills_saved / max(self._n_considered, 1)
+        return (f'Added {self._n_added} of {self._n_considered} hills; '
+                f'{self.hills_saved} ({percent:.3}%) saved against a fixed stride.')
+
+
+class BiasGated(Scheduler):
+    """
+    Only add hills where the biased energy (FES plus bias) is below a level
+
+    Metadynamics fills the FES until the biased energy is flat. Once it is flat
+    up to level, no more hills are added, so the time the particle spends in
+    basins already filled costs no hills, and the bias stops growing instead of
+    being raised evenly. The FES estimate (negative bias) is then good wherever
+    the FES is below level (relative to its minimum at zero bias), so level
+    should be above the barriers of interest.
+    """
+
+    def __init__(self, level: float):
+        """
+
+        :param level: biased energy at the particle above which no hill is added
+        """
+        super().__init__()
+        self._level = level
+
+    def _height(self, particle) -> Optional[float]:
+        if particle.potential_energy >= self._level:
+            return None
+        return particle.fes.height
+
+
+class GrowingStride(Scheduler):
+    """
+    Add hills less and less often as the run goes on
+
+    After n hills have been considered, the next n // doubling are skipped, so
+    the stride doubles after doubling hills, triples after twice that, and so
+    on. Hills are added at a constant height, so the bias fills the FES
+    quickly at first and then changes more and more slowly, and the number of
+    hills grows only logarithmically with the length of the run.
+    """
+
+    def __init__(self, doubling: int=1000):
+        """
+
+        :param doubling: number of hills considered by when the stride doubles
+        """
+        super().__init__()
+        self._doubling = int(doubling)
+        self._skip = 0
+
+    def _height(self, particle) -> Optional[float]:
+        if self._skip:
+            self._skip -= 1
+            return None
+        self._skip = self._n_considered // self._doubling
+        return particle.fes.height
+
+
+class TransitionTempered(Scheduler):
+    """
+    Transition-tempered metadynamics heights (Dama et al., JCTC 10, 3626 (2014))
+
+    Hills are added at height * exp(-V* / delta_t), where V* is the bias at
+    which all of the given basins are connected: in 1D, the lowest bias on the
+    path between the outermost basins. Hills are full height until the basins
+    are connected, so the barriers are crossed as in standard metadynamics,
+    and then shrink so that the bias converges. This does not change the number
+    of hills, only their heights. It is only for a 1D FES.
+
+    V* is found on the analysis grid of the FES if it has one in the range of
+    the basins; otherwise the bias is evaluated on points between them, which
+    is slower.
+    """
+
+    def __init__(self, basins: Sequence[float], delta_t: float, points: int=100):
+        """
+
+        :param basins: locations of (at least two) basin minima to connect
+        :param delta_t: tempering parameter (in the units of temperature, 1 / k_b)
+        :param points: number of points between the basins on which to evaluate
+        the bias if the FES has no analysis grid there
+        """
+        super().__init__()
+        if len(basins) < 2:
+            raise ValueError('At least two basins are needed')
+        self._range = min(basins), max(basins)
+        self._delta_t = delta_t
+        self._points = np.linspace(*self._range, points)
+
+    def connecting_bias(self, fes) -> float:
+        """
+        V*, the lowest bias on the path between the outermost basins
+
+        :param FES.MetadFES1D fes: the FES
+        :return: V*
+        """
+        if fes.dimensionality != 1:
+            raise ValueError('TransitionTempered is only for a 1D FES')
+        try:
+            grid = fes.analysis_grid
+        except AttributeError:
+            pass  # no analysis grid, so evaluate the bias
+        else:
+            in_range = (grid >= self._range[0]) & (grid <= self._range[1])
+            if in_range.any():
+                return float(fes.analysis_bias[in_range].min())
+        return float(np.min(fes.bias(self._points)))
+
+    def _height(self, particle) -> Optional[float]:
+        fes = particle.fes
+        return fes.height * math.exp(- self.connecting_bias(fes) / self._delta_t)
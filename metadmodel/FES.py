@@ -15,13 +15,15 @@ You should have received a copy of the GNU General Public License along with thi
 not, see http://www.gnu.org/licenses/.
 """
 
-import autograd as ag
-import autograd.numpy as anp
-import autograd.scipy as asp
+import functools
 import math
-import matplotlib.pyplot as plt
 import numpy as np
-from typing import Tuple, Callable
+from typing import Dict, Tuple, Callable, TYPE_CHECKING
+
+# matplotlib, autograd and scipy are slow to import, so they are only imported
+# when first needed (for plotting, automatic differentiation, or splines).
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
 
 
 class FES(object):
@@ -95,6 +97,16 @@ class FES(object):
         raise AttributeError('The metadynamics state is not settable. \nUse a specific'
                              'metad FES if that is what you want.')
 
+    @property
+    def n_hills(self) -> int:
+        """Number of metadynamics hills added to this FES"""
+        return 0
+
+    @property
+    def period(self) -> Tuple[float, float]:
+        """Minimum and maximum of the domain of a periodic FES (None if not periodic)"""
+        return None
+
     def add_hill(self, *args):
         raise AttributeError('Cannot add a hill to this non-metadynamics FES!')
 
@@ -108,19 +120,122 @@ class FES(object):
         pass
 
 
+def _periodic(x, func: Callable, period: Tuple[float, float]):
+    """Evaluate func at x wrapped into the period (works with autograd)"""
+    low, high = period
+    return func(low + (x - low) % (high - low))
+
+
 class FES1D(FES):
     """"""
 
-    def __init__(self, func, *args):
+    # default locations at which a supplied derivative is compared to the autograd one
+    _deriv_check_points = np.linspace(-2., 2., 11)
+
+    def __init__(self, func, *args, deriv: Callable=None, check_deriv: bool=True,
+                 period: Tuple[float, float]=None, check_points=None):
         """
         Initialize a FES object
 
+        :param func: function that defines the FES (see FES.__init__). This can
+        also be another FES1D, in which case its value and deriv are used.
         :param args:
+        :param deriv: function giving the derivative of func. If given, it is used
+        instead of differentiating func with autograd at every call, which is much
+        faster (and autograd is never imported). See the Potentials module for some
+        with closed-form derivatives.
+        :param check_deriv: If True (and deriv is given), check once that deriv
+        matches the autograd derivative of func and raise ValueError if not.
+        :param period: minimum and maximum of the domain of a periodic collective
+        variable (e.g. (-pi, pi) for a dihedral). Locations are wrapped into it
+        before func and deriv are evaluated, and metadynamics hills use the
+        minimum image.
+        :param check_points: locations at which to check deriv (default: 11 points
+        across the period if there is one, otherwise from -2 to 2). Points where
+        either derivative is not finite (e.g. outside the domain of func) are
+        skipped.
         """
+        if isinstance(func, FES1D) and deriv is None:
+            func, deriv, check_deriv = func.value, func.deriv, False
+        if period is not None:
+            period = float(period[0]), float(period[1])
+            if not period[1] > period[0]:
+                raise ValueError(f'The maximum of the period must be above the minimum; '
+                                 f'got {period}')
+            func = functools.partial(_periodic, func=func, period=period)
+            if deriv is not None:
+                deriv = functools.partial(_periodic, func=deriv, period=period)
+        self._period = period
         super().__init__(func)
         self._dimensionality = 1
         self._metad = False
-        self._grad_func = ag.grad(self._func)
+        if deriv is None:
+            import autograd as ag
+            self._grad_func = ag.grad(self._func)
+        else:
+            if check_deriv:
+                if check_points is None:
+                    check_points = self._deriv_check_points if period is None else \
+                        np.linspace(*period, 11, endpoint=False)
+                self._check_deriv(deriv, check_points)
+            self._grad_func = deriv
+
+    def _check_deriv(self, deriv: Callable, points) -> None:
+        """
+        Compare a supplied derivative to the autograd derivative of the FES function
+
+        :param deriv: derivative function to check
+        :param points: locations at which to compare them
+        :return: None
+        :raises ValueError: if they do not match, or are not finite at any point
+        """
+        import autograd as ag
+        auto_grad = ag.grad(self._func)
+        points = np.asarray(points, dtype=float).ravel()
+        with np.errstate(all='ignore'):
+            expected = np.array([auto_grad(x) for x in points], dtype=float)
+            supplied = np.array([deriv(x) for x in points], dtype=float)
+        finite = np.isfinite(expected) & np.isfinite(supplied)
+        if not finite.any():
+            raise ValueError('The derivatives are not finite at any of the check '
+                             'points; give check_points in the domain of the FES')
+        points, expected, supplied = points[finite], expected[finite], supplied[finite]
+        if not np.allclose(supplied, expected, rtol=1e-6, atol=1e-8):
+            worst = np.argmax(np.abs(supplied - expected))
+            raise ValueError(f'Supplied derivative does not match the derivative of '
+                             f'the FES function: at x = {points[worst]} got '
+                             f'{supplied[worst]}, expected {expected[worst]}')
+
+    @property
+    def period(self) -> Tuple[float, float]:
+        """Minimum and maximum of the domain of a periodic FES (None if not periodic)"""
+        return self._period
+
+    def wrap(self, x):
+        """
+        Wrap location(s) into the period (unchanged if not periodic)
+
+        :param x: location(s)
+        :return: wrapped location(s)
+        """
+        if self._period is None:
+            return x
+        low, high = self._period
+        return low + (x - low) % (high - low)
+
+    def _image_diff(self, x: np.ndarray, centers: np.ndarray) -> np.ndarray:
+        """
+        Differences between locations and centers (the minimum image if periodic)
+
+        :param x: locations
+        :param centers: centers, broadcastable with x
+        :return: x - centers
+        """
+        diff = x - centers
+        if self._period is not None:
+            length = self._period[1] - self._period[0]
+            diff -= length * np.round(diff / length)
+        return diff
 
     def value(self, x) -> float:
         """
@@ -141,38 +256,120 @@ class FES1D(FES):
         return self._grad_func(x)
 
 
+class TabulatedFES1D(FES1D):
+    """
+    1D FES defined by tabulated points and energies (e.g. a PMF)
+
+    The table is interpolated with a cubic spline whose coefficients (and those of
+    its derivative) are computed once at construction, so value and deriv are plain
+    vectorized NumPy evaluations without any autograd tracing. Beyond the ends of
+    the table the FES is continued linearly with the slope at the end point.
+
+    It can be given as the func of other 1D FES objects, e.g.
+    ``MetadFES1D(TabulatedFES1D(x, e), width, height)``. The instance is also
+    callable as an autograd-compatible function (with the spline derivative
+    registered as its gradient) for use in other autograd-traced functions.
+    """
+
+    def __init__(self, points, energies, bc_type: str='natural', *args):
+        """
+        Initialize a tabulated FES object
+
+        :param points: locations of the tabulated energies (will be sorted)
+        :param energies: energies at those points
+        :param bc_type: boundary condition of the spline, as for
+        scipy.interpolate.CubicSpline ('natural', 'not-a-knot', 'clamped', ...)
+        :param args:
+        """
+        points = np.asarray(points, dtype=float)
+        energies = np.asarray(energies, dtype=float)
+        if points.ndim != 1 or points.shape != energies.shape:
+            raise ValueError('points and energies must be 1D arrays of the same length')
+        order = np.argsort(points)
+        points, energies = points[order], energies[order]
+        if np.any(np.diff(points) <= 0):
+            raise ValueError('points must not contain duplicates')
+        from scipy.interpolate import CubicSpline
+        self._spline = CubicSpline(points, energies, bc_type=bc_type)
+        self._spline_deriv = self._spline.derivative()
+        self._bounds = points[0], points[-1]
+        self._primitive: Callable = None
+        super().__init__(self.value, *args, deriv=self.deriv, check_deriv=False)
+
+    def __call__(self, x):
+        """Evaluate the FES in a way that autograd can differentiate"""
+        if self._primitive is None:
+            import autograd as ag
+            self._primitive = ag.extend.primitive(self.value)
+            ag.extend.defvjp(self._primitive,
+                             lambda ans, x: lambda g: g * self.deriv(x))
+        return self._primitive(x)
+
+    @property
+    def bounds(self) -> Tuple[float, float]:
+        """Minimum and maximum of the tabulated points"""
+        return self._bounds
+
+    def value(self, x):
+        """
+        Return the value of the FES at this location
+
+        :param x: location(s)
+        :return: value of the FES at this location
+        """
+        x = np.asarray(x, dtype=float)
+        x_in = np.clip(x, *self._bounds)
+        return (self._spline(x_in) + (x - x_in) * self._spline_deriv(x_in))[()]
+
+    def deriv(self, x):
+        """
+        Return the derivative of the FES at this location
+
+        :param x: location(s)
+        :return: derivative of the FES at this location
+        """
+        x_in = np.clip(np.asarray(x, dtype=float), *self._bounds)
+        return self._spline_deriv(x_in)[()]
+
+
 class FES2D(FES):
     """"""
 
     def __init__(self, func, *args):
         """
+        Initialize a 2D FES object
 
+        :param func: function of two variables (x, y) that defines the FES. It must
+        work with autograd (see FES.__init__) and should accept arrays for x and y so
+        that it can be evaluated on many points at once.
         :param args:
         """
         super().__init__(func)
         self._dimensionality = 2
         self._metad = False
-        raise NotImplementedError
+        import autograd as ag
+        self._grad_funcs = (ag.elementwise_grad(self._func, 0),
+                            ag.elementwise_grad(self._func, 1))
 
     def value(self, x, y):
         """
         Return the value of the FES at this location
 
-        :param x:
-        :param y:
-        :return:
+        :param x: x coordinate(s)
+        :param y: y coordinate(s)
+        :return: value of the FES at this location
         """
-        raise NotImplementedError
+        return self._func(x, y)
 
-    def deriv(self, x, y):
+    def deriv(self, x, y) -> np.ndarray:
         """
         Return the derivative of the FES at this location
 
-        :param x:
-        :param y:
-        :return:
+        :param x: x coordinate(s)
+        :param y: y coordinate(s)
+        :return: gradient of the FES with shape (2,) + shape of x
         """
-        raise NotImplementedError
+        return np.array([grad(x, y) for grad in self._grad_funcs])
 
 
 class MetadFES1D(FES1D):
@@ -185,53 +382,385 @@ class MetadFES1D(FES1D):
     point.
     """
 
-    def __init__(self, func, width: float, height: float, *args):
+    # maximum number of elements in temporary arrays when summing hills
+    _chunk_size = 2**20
+    # number of plot grids on which the bias is cached
+    _plot_cache_size = 4
+
+    # record layout of hills saved with save_hills
+    hill_dtype = np.dtype([('center', np.float64), ('width', np.float64),
+                           ('height', np.float64)])
+
+    def __init__(self, func, width: float, height: float, *args,
+                 analysis_range: Tuple[float, float]=None, analysis_points: int=300,
+                 snapshot_stride: int=100, **kwargs):
         """
 
+        :param func: function that defines the underlying FES
+        :param width: width (sigma) of the Gaussian hills
+        :param height: height of the Gaussian hills (the default for added hills)
         :param args:
+        :param analysis_range: minimum and maximum of a fixed grid on which a
+        running estimate of the FES (the negative of the bias) is kept, updated with
+        each added hill. If None, no running estimate is kept.
+        :param analysis_points: number of points in the analysis grid
+        :param snapshot_stride: number of hills between stored snapshots of the
+        running FES estimate
+        :param kwargs: keyword arguments for FES1D (deriv, check_deriv, period,
+        check_points). For a periodic FES, the analysis grid covers the period
+        (without its end point, which is the same as its start) whatever
+        analysis_range is.
         """
-        super().__init__(func, *args)
+        super().__init__(func, *args, **kwargs)
         self._width = width
         self._height = height
         self._metad = True
-        self._hill_list = []  # might be better to do an array? pre-allocated?
-        self._fes_with_hills = self._func
-        self._grad_func = ag.grad(self._fes_with_hills)
-        self._hills: Callable = None
+        self._hill_centers = np.zeros(1024, dtype=float)
+        self._hill_heights = np.zeros(1024, dtype=float)
+        self._n_hills = 0
+        self._snapshot_stride = int(snapshot_stride)
+        if analysis_range is None:
+            self._analysis_grid = None
+            self._running_bias = None
+        else:
+            if self._period is None:
+                self._analysis_grid = np.linspace(*analysis_range, analysis_points)
+            else:
+                self._analysis_grid = np.linspace(*self._period, analysis_points,
+                                                  endpoint=False)
+            self._running_bias = np.zeros(analysis_points, dtype=float)
+        # snapshots of the bias on the analysis grid, in single precision
+        self._snapshots = np.zeros((0, analysis_points), dtype=np.float32)
+        self._n_snapshots = 0
+        # bias on recent plotting grids and the number of hills included in it,
+        # keyed by (first point, last point, number of points), oldest first
+        self._plot_cache: Dict[Tuple[float, float, int], Tuple[np.ndarray, int]] = {}
 
-    def _gaussian(self, center: float):
+    @property
+    def width(self) -> float:
+        """Width (sigma) of the Gaussian hills"""
+        return self._width
+
+    @property
+    def height(self) -> float:
+        """Default height of the Gaussian hills"""
+        return self._height
+
+    @property
+    def n_hills(self) -> int:
+        """Number of metadynamics hills added to this FES"""
+        return self._n_hills
+
+    @property
+    def hill_centers(self) -> np.ndarray:
         """
-        Gaussian function centered at center
+        Centers of the hills added so far (in order of addition)
 
-        :param center: middle of the Gaussian
-        :return: Gaussian function
-        :rtype: lambda
+        :return: array of hill centers
         """
-        # return lambda x: (self._height / (self._width * (2. * math.pi))) * \
-        #     anp.exp(-0.5 * ((x - center) / self._width)**2)
-        return lambda x: self._height * asp.stats.norm.pdf(x, loc=center, scale=self._width)
+        return self._hill_centers[:self._n_hills]
 
-    def _make_hills(self):
-        """"""
-        if not self._hill_list:
-            return lambda x: 0.
-        # Could parallelize (and save memory) by saving this as a list of Gaussians
-        # and then summing (derivatives) afterwards.
-        return lambda x: sum(self._gaussian(c)(x) for c in self._hill_list)
+    @property
+    def hill_heights(self) -> np.ndarray:
+        """
+        Heights of the hills added so far (in order of addition)
 
-    def add_hill(self, x: float) -> None:
+        :return: array of hill heights
+        """
+        return self._hill_heights[:self._n_hills]
+
+    def _sum_hills(self, x, deriv: bool=False, first: int=0, last: int=None):
+        """
+        Sum of all the hills (or of their derivatives) at this location
+
+        The Gaussians are summed in vectorized chunks of hills to limit memory use.
+        :param x: location(s)
+        :param deriv: If True, sum the derivatives of the hills instead
+        :param first: index of the first hill to include (to only add newer hills)
+        :param last: index after the last hill to include (default: all)
+        :return: sum of hills with the shape of x
+        """
+        x = np.asarray(x, dtype=float)
+        total = np.zeros(x.shape)
+        centers = self.hill_centers[first:last]
+        heights = self.hill_heights[first:last]
+        chunk = max(1, self._chunk_size // max(x.size, 1))
+        for start in range(0, len(centers), chunk):
+            diff = self._image_diff(x[..., np.newaxis],
+                                    centers[start:start+chunk]) / self._width
+            gauss = np.exp(-0.5 * diff**2)
+            if deriv:
+                gauss *= -diff / self._width
+            total += gauss @ heights[start:start+chunk]
+        return (total / (self._width * math.sqrt(2. * math.pi)))[()]
+
+    def bias(self, x):
+        """
+        Return the value of the metadynamics bias (sum of hills) at this location
+
+        :param x: location(s)
+        :return: value of the bias
+        """
+        return self._sum_hills(x)
+
+    def add_hill(self, x: float, height: float=None) -> None:
         """
         Add a hill to the FES centered here
 
         :param x: location of the particle
+        :param height: height of the hill (default: the height of this FES)
         :return:
         """
-        self._hill_list.append(x)
-        # I feel like this style below is terrible, but I am not sure how else to do it
-        # todo implement this on a grid (much faster for long simulations)
-        self._fes_with_hills = lambda var: self._make_hills()(var) + self._func(var)
-        self._grad_func = ag.grad(self._fes_with_hills)
-        # Might also need to redefine self.deriv
+        height = self._height if height is None else height
+        x = self.wrap(x)
+        if self._n_hills == len(self._hill_centers):
+            self._hill_centers = np.concatenate(
+                (self._hill_centers, np.zeros_like(self._hill_centers)))
+            self._hill_heights = np.concatenate(
+                (self._hill_heights, np.zeros_like(self._hill_heights)))
+        self._hill_centers[self._n_hills] = x
+        self._hill_heights[self._n_hills] = height
+        self._n_hills += 1
+        if self._running_bias is not None:
+            self._running_bias += self._hill(self._analysis_grid, x, height)
+            if not self._n_hills % self._snapshot_stride:
+                self._take_snapshot()
+
+    def add_hills(self, centers, heights=None) -> None:
+        """
+        Add many hills at once (in order), e.g. from a file
+
+        :param centers: centers of the hills
+        :param heights: heights of the hills (default: the height of this FES)
+        :return: None
+        """
+        centers = self.wrap(np.asarray(centers, dtype=float).ravel())
+        first, last = self._n_hills, self._n_hills + len(centers)
+        if last > len(self._hill_centers):
+            size = max(last, 2 * len(self._hill_centers))
+            new_centers, new_heights = np.zeros(size), np.zeros(size)
+            new_centers[:first] = self.hill_centers
+            new_heights[:first] = self.hill_heights
+            self._hill_centers, self._hill_heights = new_centers, new_heights
+        self._hill_centers[first:last] = centers
+        self._hill_heights[first:last] = self._height if heights is None else \
+            np.asarray(heights, dtype=float).ravel()
+        self._n_hills = last
+        if self._running_bias is None:
+            return
+        stride = self._snapshot_stride
+        # add the hills to the running estimate in groups ending at snapshots
+        start = first
+        while start < last:
+            stop = min(last, (start // stride + 1) * stride)
+            self._running_bias += self._sum_hills(self._analysis_grid,
+                                                  first=start, last=stop)
+            if not stop % stride:
+                self._take_snapshot()
+            start = stop
+
+    def _take_snapshot(self) -> None:
+        """
+        Store a snapshot of the running bias on the analysis grid
+
+        :return: None
+        """
+        if self._n_snapshots == len(self._snapshots):
+            self._snapshots = np.concatenate(
+                (self._snapshots,
+                 np.zeros((max(16, self._n_snapshots), self._snapshots.shape[1]),
+                          dtype=self._snapshots.dtype)))
+        self._snapshots[self._n_snapshots] = self._running_bias
+        self._n_snapshots += 1
+
+    def save_hills(self, path: str) -> None:
+        """
+        Save the hills to a binary (.npy) file
+
+        The file holds one record (center, width, height) per hill and can be read
+        in one go or memory-mapped with np.load.
+        :param path: file to write
+        :return: None
+        """
+        hills = np.empty(self._n_hills, dtype=self.hill_dtype)
+        hills['center'] = self.hill_centers
+        hills['width'] = self._width
+        hills['height'] = self.hill_heights
+        np.save(path, hills)
+
+    def _check_hill_widths(self, widths) -> None:
+        """
+        Make sure that hills to be loaded have the width of the hills of this FES
+
+        :param widths: widths of the hills
+        :return: None
+        :raises ValueError: if they do not match
+        """
+        if not np.allclose(widths, self._width):
+            raise ValueError(f'Hills to load must have the width ({self._width}) '
+                             f'of this FES')
+
+    def load_hills(self, path: str) -> None:
+        """
+        Add the hills saved by save_hills to this FES
+
+        :param path: file to read
+        :return: None
+        """
+        hills = np.load(path, mmap_mode='r')
+        self._check_hill_widths(hills['width'])
+        self.add_hills(hills['center'], hills['height'])
+
+    def export_plumed_hills(self, path: str, times=None, cv_name: str='x') -> None:
+        """
+        Write the hills as a PLUMED HILLS file
+
+        PLUMED hills are unnormalized Gaussians, so the height written for each
+        hill is the height of its peak, height / (width * sqrt(2 pi)).
+        :param path: file to write
+        :param times: time at which each hill was added (default: its index)
+        :param cv_name: name of the collective variable
+        :return: None
+        """
+        if times is None:
+            times = np.arange(self._n_hills)
+        peaks = self.hill_heights / (self._width * math.sqrt(2. * math.pi))
+        columns = np.column_stack((times, self.hill_centers,
+                                   np.full(self._n_hills, self._width), peaks,
+                                   np.ones(self._n_hills)))
+        header = (f'#! FIELDS time {cv_name} sigma_{cv_name} height biasf\n'
+                  f'#! SET multivariate false')
+        if self._period is not None:
+            header += (f'\n#! SET min_{cv_name} {self._period[0]!r}'
+                       f'\n#! SET max_{cv_name} {self._period[1]!r}')
+        np.savetxt(path, columns, fmt='%.10g', header=header, comments='')
+
+    def import_plumed_hills(self, path: str) -> np.ndarray:
+        """
+        Add the hills from a (1D) PLUMED HILLS file to this FES
+
+        :param path: file to read
+        :return: times of the hills from the file
+        """
+        fields = None
+        with open(path) as f:
+            for line in f:
+                if line.startswith('#! FIELDS'):
+                    fields = line.split()[2:]
+                    break
+        if fields is None or len(fields) < 4 or fields[0] != 'time':
+            raise ValueError(f'{path} does not look like a PLUMED HILLS file')
+        cv_name = fields[1]
+        if fields[2:4] != [f'sigma_{cv_name}', 'height']:
+            raise ValueError(f'{path} is not a HILLS file of one CV; its fields '
+                             f'are {" ".join(fields)}')
+        data = np.loadtxt(path, comments='#', ndmin=2)
+        widths = data[:, 2]
+        heights = data[:, 3] * widths * math.sqrt(2. * math.pi)
+        self._check_hill_widths(widths)
+        self.add_hills(data[:, 1], heights)
+        return data[:, 0]
+
+    def _hill(self, x: np.ndarray, center: float, height: float) -> np.ndarray:
+        """
+        Value of a single hill centered at center
+
+        :param x: locations
+        :param center: center of the hill
+        :param height: height of the hill
+        :return: value of the hill at x
+        """
+        return (height / (self._width * math.sqrt(2. * math.pi)) *
+                np.exp(-0.5 * (self._image_diff(x, center) / self._width)**2))
+
+    def _check_analysis(self) -> None:
+        """Raise an error if no running FES estimate is being kept"""
+        if self._analysis_grid is None:
+            raise AttributeError('No analysis grid. Give analysis_range when '
+                                 'creating this FES to track the FES estimate.')
+
+    @property
+    def analysis_grid(self) -> np.ndarray:
+        """
+        Locations at which the running FES estimate is kept
+
+        :return: analysis grid
+        """
+        self._check_analysis()
+        return self._analysis_grid
+
+    @property
+    def analysis_bias(self) -> np.ndarray:
+        """
+        Current bias on the analysis grid (updated in place as hills are added)
+
+        :return: bias on the analysis grid
+        """
+        self._check_analysis()
+        return self._running_bias
+
+    @property
+    def fes_estimate(self) -> np.ndarray:
+        """
+        Current estimate of the FES (negative bias) on the analysis grid
+
+        :return: estimated FES with its minimum set to zero
+        """
+        self._check_analysis()
+        estimate = - self._running_bias
+        return estimate - estimate.min()
+
+    @property
+    def fes_snapshots(self) -> np.ndarray:
+        """
+        Estimates of the FES on the analysis grid stored every snapshot_stride hills
+
+        :return: array (snapshots x grid points) with the minimum of each set to zero
+        """
+        self._check_analysis()
+        estimates = - self._snapshots[:self._n_snapshots]
+        return estimates - estimates.min(axis=1, keepdims=True)
+
+    @property
+    def snapshot_hills(self) -> np.ndarray:
+        """
+        Number of hills that had been added at each snapshot
+
+        :return: array of the number of hills
+        """
+        return self._snapshot_stride * np.arange(1, self._n_snapshots + 1)
+
+    def convergence_rms(self) -> np.ndarray:
+        """
+        Root-mean-square change of the FES estimate between consecutive snapshots
+
+        :return: array of RMS changes (one fewer than the number of snapshots)
+        """
+        return np.sqrt(np.mean(np.diff(self.fes_snapshots, axis=0)**2, axis=1))
+
+    def delta_g(self, basin_a: Tuple[float, float], basin_b: Tuple[float, float],
+                temp: float=None) -> np.ndarray:
+        """
+        Free energy difference G_b - G_a between two basins for each snapshot
+
+        :param basin_a: minimum and maximum of the first basin
+        :param basin_b: minimum and maximum of the second basin
+        :param temp: temperature (in units of 1 / k_b). If given, the free energy of
+        each basin is found by Boltzmann-weighted integration over the basin;
+        otherwise the difference between the minima of the basins is given.
+        :return: array of free energy differences, one per snapshot
+        """
+        grid = self.analysis_grid
+        fes = self.fes_snapshots.astype(float)
+        in_a = (grid >= basin_a[0]) & (grid <= basin_a[1])
+        in_b = (grid >= basin_b[0]) & (grid <= basin_b[1])
+        if not (in_a.any() and in_b.any()):
+            raise ValueError('Each basin must contain at least one grid point')
+        if temp is None:
+            return fes[:, in_b].min(axis=1) - fes[:, in_a].min(axis=1)
+        weights = np.exp(-fes / temp)
+        return - temp * np.log(weights[:, in_b].sum(axis=1) /
+                               weights[:, in_a].sum(axis=1))
 
     def value(self, x) -> float:
         """
@@ -240,38 +769,113 @@ class MetadFES1D(FES1D):
         :param x: location
         :return: value of the FES and hills at this location
         """
-        return self._fes_with_hills(x)
+        return self._func(x) + self._sum_hills(x)
+
+    def deriv(self, x) -> float:
+        """
+        Return the derivative of the FES and hills at this location
+
+        The hills are differentiated analytically; the underlying FES uses the
+        supplied derivative or autograd (see FES1D).
+        :param x: location
+        :return: derivative of the FES and hills at this location
+        """
+        return self._grad_func(x) + self._sum_hills(x, deriv=True)
+
+    def func_deriv(self, x) -> float:
+        """
+        Return the derivative of only the underlying FES (no hills) at this location
+
+        :param x: location
+        :return: derivative of the underlying FES
+        """
+        return self._grad_func(x)
+
+    def bias_deriv(self, x) -> float:
+        """
+        Return the derivative of only the bias (sum of hills) at this location
+
+        :param x: location
+        :return: derivative of the bias
+        """
+        return self._sum_hills(x, deriv=True)
+
+    def _plot_grid(self, points: int, minmax: Tuple[float, float],
+                   expand: float) -> np.ndarray:
+        """
+        Locations at which to evaluate the FES for plotting
+
+        If there is a running FES estimate with this many points and minmax is not
+        given, its analysis grid is used so that the bias does not need to be
+        evaluated at all.
+        :param points: number of points
+        :param minmax: minimum and maximum of the plot range
+        :param expand: factor to plot beyond min and max of added hills
+        :return: plot locations
+        """
+        if minmax:
+            min_hill, max_hill = minmax
+        elif (self._analysis_grid is not None and
+              len(self._analysis_grid) == points):
+            return self._analysis_grid
+        elif self._period is not None:
+            return np.linspace(*self._period, points, endpoint=False)
+        else:
+            min_hill, max_hill = self.hill_centers.min(), self.hill_centers.max()
+            span = abs(max_hill - min_hill)
+            min_hill, max_hill = min_hill - expand * span, max_hill + expand * span
+        return np.linspace(min_hill, max_hill, points)
+
+    def _plot_bias(self, x: np.ndarray) -> np.ndarray:
+        """
+        Bias at the plot locations, reusing earlier evaluations
+
+        The bias on each of the last few plot grids is cached, so plotting again
+        on one of them only needs to add the hills added since then. Without
+        minmax or an analysis grid, the default grid follows the range of the
+        hills, so each hill that extends that range means a new grid on which all
+        of the hills are summed; give minmax (or an analysis grid) to avoid this.
+        :param x: plot locations
+        :return: bias at x
+        """
+        if x is self._analysis_grid:
+            return self._running_bias.copy()
+        key = float(x[0]), float(x[-1]), len(x)
+        bias, n_done = self._plot_cache.pop(key, (np.zeros_like(x), 0))
+        if n_done < self._n_hills:
+            bias = bias + self._sum_hills(x, first=n_done)
+        self._plot_cache[key] = bias, self._n_hills
+        if len(self._plot_cache) > self._plot_cache_size:
+            del self._plot_cache[next(iter(self._plot_cache))]
+        return bias.copy()
 
     def plot_hills(self, points: int=300, minmax: Tuple[float, float]=None,
-                   expand: float=0.1, mintozero: bool=True, **kwargs) -> plt.figure:
+                   expand: float=0.1, mintozero: bool=True,
+                   **kwargs) -> 'plt.figure':
         """
         Plot the metadynamics hills and return the figure
 
         :param points: number of points to plot
+
+        If minmax is not given and there is an analysis grid with this many points,
+        that grid is used.
         :param minmax: minimum and maximum of the plot range
         :param expand: factor to plot beyond min and max of added hills
 
-        This is ignored if minmax is given
+        This is ignored if minmax is given, or if the analysis grid is used
         :param mintozero: If True, sets the minimum of the calculated FES to zero
         :param kwargs: arguments to be passed to ax.plot
         :return: figure of the plot
         """
-        if not self._hill_list:
+        if not self._n_hills:
             print('No hills listed. Are you sure this has been run already?')
             return None
-        if self._hills is None:
-            self._hills: Callable = self._make_hills()
-        if minmax:
-            min_hill, max_hill = minmax
-        else:
-            min_hill, max_hill = min(self._hill_list), max(self._hill_list)
-            span = abs(max_hill - min_hill)
-            min_hill, max_hill = min_hill - expand * span, max_hill + expand * span
-        x = np.linspace(min_hill, max_hill, points)
+        x = self._plot_grid(points, minmax, expand)
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots()
-        hills = - self._hills(x)
+        hills = - self._plot_bias(x)
         if mintozero:
-            hills = hills - min(hills)
+            hills = hills - hills.min()
         ax.plot(x, hills, **kwargs)
         ax.set_xlabel('$x$')
         ax.set_ylabel('$V$')
@@ -279,62 +883,60 @@ class MetadFES1D(FES1D):
         return fig
 
     def plot_eff_fes(self, points: int=300, minmax: Tuple[float, float]=None,
-                     expand: float=0.1, drawboth: bool=True, **kwargs) -> plt.figure:
+                     expand: float=0.1, drawboth: bool=True,
+                     **kwargs) -> 'plt.figure':
         """
         Plot the FES on which the particle actually travels (including hills)
 
         :param points: number of points to plot
+
+        If minmax is not given and there is an analysis grid with this many points,
+        that grid is used.
         :param minmax: minimum and maximum of the plot range
         :param expand: factor to plot beyond min and max of added hills
 
-        This is ignored if minmax is given
+        This is ignored if minmax is given, or if the analysis grid is used
         :param drawboth: If True, draw both original FES function and the one including
         the hills.
         :param kwargs: arguments to be passed to ax.plot
         :return: figure of the plot
         """
-        if not self._hill_list:
+        if not self._n_hills:
             print('No hills listed. Are you sure this has been run already?')
             return None
-        if minmax:
-            min_hill, max_hill = minmax
-        else:
-            min_hill, max_hill = min(self._hill_list), max(self._hill_list)
-            span = abs(max_hill - min_hill)
-            min_hill, max_hill = min_hill - expand * span, max_hill + expand * span
-        x = np.linspace(min_hill, max_hill, points)
+        x = self._plot_grid(points, minmax, expand)
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots()
-        ax.plot(x, self._fes_with_hills(x))
+        fes = self._func(x)
+        ax.plot(x, fes + self._plot_bias(x))
         if drawboth:
-            ax.plot(x, self._func(x))
+            ax.plot(x, fes)
         ax.set_xlabel('$x$')
         ax.set_ylabel('$V$')
         fig.tight_layout()
         return fig
 
     def plot_fes(self, points: int=300, minmax: Tuple[float, float]=None,
-                 expand: float=0.1, **kwargs) -> plt.figure:
+                 expand: float=0.1, **kwargs) -> 'plt.figure':
         """
         Plot the FES on which the particle actually travels (including hills)
 
         :param points: number of points to plot
+
+        If minmax is not given and there is an analysis grid with this many points,
+        that grid is used.
         :param minmax: minimum and maximum of the plot range
         :param expand: factor to plot beyond min and max of added hills
 
-        This is ignored if minmax is given
+        This is ignored if minmax is given, or if the analysis grid is used
         :param kwargs: arguments to be passed to ax.plot
         :return: figure of the plot
         """
-        if not self._hill_list:
+        if not self._n_hills:
             print('No hills listed. Are you sure this has been run already?')
             return None
-        if minmax:
-            min_hill, max_hill = minmax
-        else:
-            min_hill, max_hill = min(self._hill_list), max(self._hill_list)
-            span = abs(max_hill - min_hill)
-            min_hill, max_hill = min_hill - expand * span, max_hill + expand * span
-        x = np.linspace(min_hill, max_hill, points)
+        x = self._plot_grid(points, minmax, expand)
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots()
         ax.plot(x, self._func(x))
         ax.set_xlabel('$x$')
@@ -343,27 +945,251 @@ class MetadFES1D(FES1D):
         return fig
 
 
-
-
 class MetadFES2D(FES2D):
-    """"""
+    """
+    2D metadynamics FES with the bias stored on a grid
+
+    Every added hill is accumulated onto a regular grid of bias values (and of its
+    analytic derivatives), so the cost of evaluating the bias or its gradient does not
+    grow with the number of hills. Values between grid points are found by bilinear
+    interpolation. Outside of the grid the bias is that at the nearest point of its
+    edge (so it has no step there), and only the part of a hill on the grid is
+    added, so the grid should cover the region the particle visits.
+    """
 
-    def __init__(self, func, width, height, *args):
+    def __init__(self, func, width: float, height: float,
+                 grid_min: Tuple[float, float]=(-5., -5.),
+                 grid_max: Tuple[float, float]=(5., 5.),
+                 grid_bins: Tuple[int, int]=(201, 201), *args):
         """
 
+        :param func: function of two variables that defines the FES
+        :param width: width (sigma) of the Gaussian hills (same in x and y)
+        :param height: height of the Gaussian hills
+        :param grid_min: minimum (x, y) of the bias grid
+        :param grid_max: maximum (x, y) of the bias grid
+        :param grid_bins: number of grid points in (x, y)
+
+        The grid spacing should be small compared to width for accurate
+        interpolation.
         :param args:
         """
         super().__init__(func, *args)
         self._width = width
         self._height = height
         self._metad = True
+        self._hill_list = []
+        self._grid_min = np.array(grid_min, dtype=float)
+        self._grid_max = np.array(grid_max, dtype=float)
+        self._grid_bins = np.array(grid_bins, dtype=int)
+        if np.any(self._grid_bins < 2) or np.any(self._grid_max <= self._grid_min):
+            raise ValueError('The bias grid needs at least 2 bins and grid_max > '
+                             'grid_min in each dimension')
+        self._spacing = (self._grid_max - self._grid_min) / (self._grid_bins - 1)
+        self._grid_x = np.linspace(self._grid_min[0], self._grid_max[0],
+                                   self._grid_bins[0])
+        self._grid_y = np.linspace(self._grid_min[1], self._grid_max[1],
+                                   self._grid_bins[1])
+        # bias value and its x and y derivatives, indexed [ix, iy]
+        self._bias_grid = np.zeros(tuple(self._grid_bins), dtype=float)
+        self._bias_grad_grids = np.zeros((2,) + tuple(self._grid_bins), dtype=float)
+
+    @property
+    def width(self) -> float:
+        """Width (sigma) of the Gaussian hills"""
+        return self._width
 
-    def add_hill(self, x, y):
+    @property
+    def height(self) -> float:
+        """Default height of the Gaussian hills"""
+        return self._height
+
+    @property
+    def grid(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Coordinates of the bias grid points
+
+        :return: x and y grid coordinates (1D each)
+        """
+        return self._grid_x, self._grid_y
+
+    @property
+    def n_hills(self) -> int:
+        """Number of metadynamics hills added to this FES"""
+        return len(self._hill_list)
+
+    @property
+    def bias_grid(self) -> np.ndarray:
+        """
+        Values of the accumulated bias on the grid
+
+        :return: bias values (x bins by y bins)
+        """
+        return self._bias_grid
+
+    def add_hill(self, x: float, y: float, height: float=None) -> None:
         """
         Add a hill to the FES centered here
 
-        :param x:
-        :param y:
+        The Gaussian is separable, so it is added to the grid as the outer product
+        of a Gaussian along x and one along y.
+        :param x: x location of the particle
+        :param y: y location of the particle
+        :param height: height of the hill (default: the height of this FES)
         :return:
         """
-        raise NotImplementedError
+        height = self._height if height is None else height
+        self._hill_list.append((float(x), float(y)))
+        norm = 1. / (self._width * math.sqrt(2. * math.pi))
+        dx = (self._grid_x - x) / self._width
+        dy = (self._grid_y - y) / self._width
+        gauss_x = norm * np.exp(-0.5 * dx**2)
+        gauss_y = norm * np.exp(-0.5 * dy**2)
+        self._bias_grid += height * np.outer(gauss_x, gauss_y)
+        self._bias_grad_grids[0] += height * np.outer(
+            -dx / self._width * gauss_x, gauss_y)
+        self._bias_grad_grids[1] += height * np.outer(
+            gauss_x, -dy / self._width * gauss_y)
+
+    def _interpolate(self, grid: np.ndarray, x, y, along: int=None):
+        """
+        Bilinearly interpolate values on the bias grid
+
+        Outside of the grid, the value at the nearest point of its edge is used.
+        :param grid: array of values on the grid (x bins by y bins)
+        :param x: x coordinate(s)
+        :param y: y coordinate(s)
+        :param along: for a component of the gradient, the dimension it is along
+        (0 for x, 1 for y). It is zero beyond the grid in that dimension, where
+        the bias does not change along it.
+        :return: interpolated value(s)
+        """
+        n_x, n_y = self._grid_bins
+        fx = (np.asarray(x, dtype=float) - self._grid_min[0]) / self._spacing[0]
+        fy = (np.asarray(y, dtype=float) - self._grid_min[1]) / self._spacing[1]
+        beyond = None if along is None else \
+            [(fx < 0) | (fx > n_x - 1), (fy < 0) | (fy > n_y - 1)][along]
+        fx = np.clip(fx, 0, n_x - 1)
+        fy = np.clip(fy, 0, n_y - 1)
+        ix = np.minimum(np.floor(fx).astype(int), n_x - 2)
+        iy = np.minimum(np.floor(fy).astype(int), n_y - 2)
+        tx = fx - ix
+        ty = fy - iy
+        values = (grid[ix, iy] * (1. - tx) * (1. - ty) +
+                  grid[ix + 1, iy] * tx * (1. - ty) +
+                  grid[ix, iy + 1] * (1. - tx) * ty +
+                  grid[ix + 1, iy + 1] * tx * ty)
+        if beyond is not None:
+            values = np.where(beyond, 0., values)
+        return values[()]
+
+    def bias(self, x, y):
+        """
+        Return the value of the accumulated bias at this location
+
+        :param x: x coordinate(s)
+        :param y: y coordinate(s)
+        :return: value of the bias
+        """
+        return self._interpolate(self._bias_grid, x, y)
+
+    def value(self, x, y):
+        """
+        Return the value of the FES and hills at this location
+
+        :param x: x coordinate(s)
+        :param y: y coordinate(s)
+        :return: value of the FES and hills at this location
+        """
+        return self._func(x, y) + self.bias(x, y)
+
+    def deriv(self, x, y) -> np.ndarray:
+        """
+        Return the derivative of the FES and hills at this location
+
+        :param x: x coordinate(s)
+        :param y: y coordinate(s)
+        :return: gradient with shape (2,) + shape of x
+        """
+        return self.func_deriv(x, y) + self.bias_deriv(x, y)
+
+    def func_deriv(self, x, y) -> np.ndarray:
+        """
+        Return the derivative of only the underlying FES (no hills) at this location
+
+        :param x: x coordinate(s)
+        :param y: y coordinate(s)
+        :return: gradient with shape (2,) + shape of x
+        """
+        return super().deriv(x, y)
+
+    def bias_deriv(self, x, y) -> np.ndarray:
+        """
+        Return the derivative of only the accumulated bias at this location
+
+        :param x: x coordinate(s)
+        :param y: y coordinate(s)
+        :return: gradient with shape (2,) + shape of x
+        """
+        return np.array([self._interpolate(grid, x, y, along)
+                         for along, grid in enumerate(self._bias_grad_grids)])
+
+    def _plot_surface(self, values: np.ndarray, levels: int,
+                      **kwargs) -> 'plt.figure':
+        """
+        Draw a filled contour plot of values on the bias grid
+
+        :param values: values on the grid (x bins by y bins)
+        :param levels: number of contour levels
+        :param kwargs: arguments to be passed to ax.contourf
+        :return: figure of the plot
+        """
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots()
+        contours = ax.contourf(self._grid_x, self._grid_y, values.T, levels, **kwargs)
+        fig.colorbar(contours, ax=ax, label='$V$')
+        ax.set_xlabel('$x$')
+        ax.set_ylabel('$y$')
+        fig.tight_layout()
+        return fig
+
+    def plot_hills(self, levels: int=30, mintozero: bool=True,
+                   **kwargs) -> 'plt.figure':
+        """
+        Plot the negative of the metadynamics bias on the grid and return the figure
+
+        :param levels: number of contour levels
+        :param mintozero: If True, sets the minimum of the calculated FES to zero
+        :param kwargs: arguments to be passed to ax.contourf
+        :return: figure of the plot
+        """
+        if not self._hill_list:
+            print('No hills listed. Are you sure this has been run already?')
+            return None
+        hills = - self._bias_grid
+        if mintozero:
+            hills = hills - hills.min()
+        return self._plot_surface(hills, levels, **kwargs)
+
+    def plot_eff_fes(self, levels: int=30, **kwargs) -> 'plt.figure':
+        """
+        Plot the FES on which the particle actually travels (including hills)
+
+        :param levels: number of contour levels
+        :param kwargs: arguments to be passed to ax.contourf
+        :return: figure of the plot
+        """
+        x, y = np.meshgrid(self._grid_x, self._grid_y, indexing='ij')
+        return self._plot_surface(self._func(x, y) + self._bias_grid, levels,
+                                  **kwargs)
+
+    def plot_fes(self, levels: int=30, **kwargs) -> 'plt.figure':
+        """
+        Plot the underlying FES (without hills) over the bias grid
+
+        :param levels: number of contour levels
+        :param kwargs: arguments to be passed to ax.contourf
+        :return: figure of the plot
+        """
+        x, y = np.meshgrid(self._grid_x, self._grid_y, indexing='ij')
+        return self._plot_surface(self._func(x, y), levels, **kwargs)
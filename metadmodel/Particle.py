@@ -23,17 +23,22 @@ from random import gauss
 class Particle(object):
     """"""
 
-    def __init__(self, fes: FES.FES, x0: float, v0: float=None, mass: float=1.,
+    def __init__(self, fes: FES.FES, x0, v0=None, mass: float=1.,
                  time_step_size: float=1., temp: float=None,
-                 nh_const: float=None):
+                 nh_const: float=None, respa_steps: int=1, walls: tuple=None,
+                 wall_const: float=None):
         """
 
         :param FES.FES fes: FES on which the particle moves
         :param np.array x0: initial position of the particle
+
+        For a 1D FES this is a float; otherwise an array with one element per
+        dimension.
         :param np.array v0: initial velocity of the particle
 
         If a temperature is provided, and a velocity is not, the velocity will be
-        randomly selected from a normal distribution with mean zero and sigma sqrt(kT/m).
+        randomly selected from a normal distribution with mean zero and sigma sqrt(kT/m)
+        (independently for each dimension).
 
         If no temperature or velocity is provided, an error will be raised.
         :param float mass: mass of the particle
@@ -41,29 +46,69 @@ class Particle(object):
         :param temp: temperature of the particle (for constant T simulations) in units of
         (1 / k_b)
         :param nh_const: The Nose-Hoover thermostat constant (often called Q)
+        :param respa_steps: number of steps between applications of the bias force
+        (k of r-RESPA, see move). 1 (the default) applies it every step.
+        :param walls: lower and upper bounds of the position (each a float, or
+        for more than 1D, one per dimension) at which there are walls. Walls
+        cannot be used on a periodic FES, where the position is wrapped into its
+        period.
+        :param wall_const: force constant of harmonic walls, which push the particle
+        back with force -wall_const * (distance beyond the bound). If None (the
+        default), the walls reflect the particle elastically (the energy is
+        conserved on average; each bounce still has an error of order the time
+        step, from crossing the wall part way through a step).
         """
         self._FES = fes
         self._mass = float(mass)
-        self._position = float(x0)
+        self._period = fes.period
+        self._position = self._as_vector(x0)
+        if self._period is not None:
+            self._position = self._FES.wrap(self._position)
         self._fric = 0.
         self._time_step_size = float(time_step_size)
         self._metad = self._FES.metad
-        self._temp = float(temp)
+        self._temp = float(temp) if temp else 0.
         if self._temp:
             if not nh_const:
                 raise SyntaxError('If temp is defined (const. T simulation) the '
                                   'Nose-Hoover constant nh_const must also be defined')
             if v0 is None:
-                self._velocity = gauss(0, np.sqrt(self._temp / self._mass))
+                sigma = np.sqrt(self._temp / self._mass)
+                if self.dimensionality == 1:
+                    self._velocity = gauss(0, sigma)
+                else:
+                    self._velocity = np.random.normal(0, sigma, self.dimensionality)
             else:
-                self._velocity = float(v0)
+                self._velocity = self._as_vector(v0)
         elif v0 is None:
             raise SyntaxError('If temp is not defined, v0 must be given.')
         else:
-            self._velocity = float(v0)
-        self._nhc = float(nh_const)
-
-        self.frics = []
+            self._velocity = self._as_vector(v0)
+        self._nhc = float(nh_const) if nh_const else None
+        if walls is None:
+            self._walls = None
+        elif self._period is not None:
+            raise ValueError('Walls cannot be used on a periodic FES')
+        else:
+            low, high = (self._as_vector(np.broadcast_to(bound, self.dimensionality)
+                                         if self.dimensionality > 1 else bound)
+                         for bound in walls)
+            if np.any(np.asarray(high) <= np.asarray(low)):
+                raise ValueError(f'The upper walls must be above the lower; got {walls}')
+            self._walls = low, high
+        self._wall_const = None if wall_const is None else float(wall_const)
+        self._respa_steps = int(respa_steps)
+        if self._respa_steps > 1 and not self._metad:
+            raise ValueError('Multiple time steps (respa_steps > 1) are only for '
+                             'metadynamics, to apply the bias force less often')
+        # number of steps taken in the current r-RESPA cycle
+        self._respa_step = 0
+        # accelerations at the current position: part -> (number of hills, value)
+        self._accelerations = {}
+        # integral of the thermostat friction over time, and energy added by hills,
+        # both for the conserved energy
+        self._fric_integral = 0.
+        self._hill_energy = 0.
 
     @property
     def position(self):
@@ -79,6 +124,7 @@ class Particle(object):
     def position(self, value):
         print('Overriding current position.')
         self._position = value
+        self._accelerations = {}
 
     @property
     def velocity(self):
@@ -103,12 +149,44 @@ class Particle(object):
         :return: the force on the particle
         :rtype: np.array
         """
-        return -self._FES.deriv(self._position)
+        return -self._FES.deriv(*self._fes_args(self._position))
 
     @force.setter
     def force(self, value):
         raise AttributeError('force is not currently settable')
 
+    @property
+    def bias(self) -> float:
+        """
+        The metadynamics bias energy at the current position (zero without metad)
+
+        :return: the bias energy
+        """
+        if not self._metad:
+            return 0.
+        return self._FES.bias(*self._fes_args(self._position))
+
+    @bias.setter
+    def bias(self, value):
+        raise AttributeError('bias is not settable')
+
+    @property
+    def potential_energy(self) -> float:
+        """
+        The value of the FES (including any bias and harmonic walls) here
+
+        :return: the potential energy
+        """
+        energy = self._FES.value(*self._fes_args(self._position))
+        if self._walls is not None and self._wall_const is not None:
+            beyond = self._beyond_walls()
+            energy += 0.5 * self._wall_const * np.sum(beyond**2)
+        return energy
+
+    @potential_energy.setter
+    def potential_energy(self, value):
+        raise AttributeError('potential_energy is not settable')
+
     @property
     def acceleration(self):
         """
@@ -117,12 +195,85 @@ class Particle(object):
         :return: the acceleration
         :rtype: np.array
         """
-        return self.force / self._mass
+        return self._acceleration('total')
 
     @acceleration.setter
     def acceleration(self, value):
         raise AttributeError('acceleration not currently settable')
 
+    @property
+    def fes(self) -> FES.FES:
+        """
+        FES on which the particle travels
+
+        :return: the FES
+        """
+        return self._FES
+
+    @fes.setter
+    def fes(self, value):
+        raise AttributeError('The FES of a Particle cannot be changed')
+
+    @property
+    def time_step_size(self) -> float:
+        """
+        Size of the (inner) time steps
+
+        :return: the time step size
+        """
+        return self._time_step_size
+
+    @time_step_size.setter
+    def time_step_size(self, value):
+        raise AttributeError('time_step_size is not currently settable')
+
+    @property
+    def respa_steps(self) -> int:
+        """
+        Number of steps between applications of the bias force (see move)
+
+        :return: the number of steps
+        """
+        return self._respa_steps
+
+    @respa_steps.setter
+    def respa_steps(self, value):
+        raise AttributeError('respa_steps can only be set when creating the Particle')
+
+    @property
+    def conserved_energy(self) -> float:
+        """
+        Energy that exact integration would conserve, to check the integration
+
+        This is the kinetic plus potential energy, plus the energy of the Nose-Hoover
+        thermostat, minus the energy added by hills under the particle. The friction
+        xi is updated by half a step each step in move, as with a thermostat constant
+        of 2 Q, so the thermostat energy is Q xi**2 + (dimensionality + 1) T
+        integral(xi dt), and it is only conserved to first order in the time step.
+        With r-RESPA it is only conserved at the ends of cycles of respa_steps steps.
+
+        :return: the conserved energy
+        """
+        energy = (0.5 * self._mass * np.sum(self._velocity**2) +
+                  self.potential_energy - self._hill_energy)
+        if self._temp:
+            energy += (self._nhc * self._fric**2 +
+                       (1 + self.dimensionality) * self._temp * self._fric_integral)
+        return float(energy)
+
+    @property
+    def temp(self) -> float:
+        """
+        Temperature of the thermostat (zero for constant energy)
+
+        :return: the temperature in units of (1 / k_b)
+        """
+        return self._temp
+
+    @temp.setter
+    def temp(self, value):
+        raise AttributeError('temp is not currently settable')
+
     @property
     def fric(self):
         """
@@ -165,12 +316,118 @@ class Particle(object):
         raise AttributeError('The metadynamics state is not settable. \nUse a specific'
                              'metad FES if that is what you want.')
 
+    def _as_vector(self, value):
+        """
+        Convert a position or velocity to the form used for this dimensionality
+
+        :param value: scalar (1D) or sequence with one element per dimension
+        :return: float for 1D, otherwise an array of floats
+        """
+        if self.dimensionality == 1:
+            return float(value)
+        value = np.array(value, dtype=float)
+        if value.shape != (self.dimensionality,):
+            raise ValueError(f'Expected {self.dimensionality} components, '
+                             f'got shape {value.shape}')
+        return value
+
+    def _fes_args(self, position) -> tuple:
+        """
+        Arguments to give the FES methods (which take one argument per dimension)
+
+        :param position: position as stored by this Particle
+        :return: tuple of coordinates
+        """
+        if self.dimensionality == 1:
+            return position,
+        return tuple(position)
+
+    def _acceleration(self, part: str):
+        """
+        Acceleration from the force of part of the FES at the current position
+
+        Each is kept until the particle moves or a hill is added, so the force at
+        the end of one step is not computed again for the start of the next.
+        :param part: 'total' for the whole FES, 'func' for only the underlying FES,
+        or 'bias' for only the metadynamics bias
+        :return: the acceleration
+        """
+        n_hills = self._FES.n_hills
+        cached = self._accelerations.get(part)
+        if cached is not None and cached[0] == n_hills:
+            return cached[1]
+        deriv = self._FES.deriv if part == 'total' else \
+            getattr(self._FES, f'{part}_deriv')
+        acceleration = -deriv(*self._fes_args(self._position)) / self._mass
+        if (part != 'bias' and self._walls is not None and
+                self._wall_const is not None):
+            acceleration = acceleration - \
+                self._wall_const / self._mass * self._beyond_walls()
+        self._accelerations[part] = n_hills, acceleration
+        return acceleration
+
+    def _mirrored_acceleration(self, part: str, reflected):
+        """
+        Acceleration at the current position, mirrored in the dimensions reflected
+
+        After a reflection, the step is finished in the mirror image of the
+        reflected dimensions (where the particle went past the wall) before the
+        velocity is flipped, so that the force kicks with the motion and the
+        bounce is elastic.
+        :param part: part of the FES whose force to use (see _acceleration)
+        :param reflected: mask of the dimensions reflected, or None
+        :return: the acceleration
+        """
+        acceleration = self._acceleration(part)
+        if reflected is None:
+            return acceleration
+        return self._as_vector(np.where(reflected, -acceleration, acceleration))
+
+    def _beyond_walls(self):
+        """Distance beyond the walls (negative below the lower, zero between)"""
+        low, high = self._walls
+        return (np.maximum(self._position - high, 0.) +
+                np.minimum(self._position - low, 0.))
+
+    def _constrain_position(self):
+        """
+        Wrap the position into the period of a periodic FES and reflect it off
+        reflecting walls
+
+        :return: mask of the dimensions reflected, or None if none were
+        """
+        if self._period is not None:
+            self._position = self._FES.wrap(self._position)
+        if self._walls is not None and self._wall_const is None:
+            return self._reflect()
+        return None
+
+    def _reflect(self):
+        """
+        Reflect the position off the walls it has passed
+
+        :return: mask of the dimensions reflected, or None if none were
+        """
+        beyond = self._beyond_walls()
+        if not np.any(beyond):
+            return None
+        position = self._position - 2. * beyond
+        self._position = self._as_vector(position)
+        return beyond != 0.
+
     def move(self, time: float=1., return_prev: bool=False) -> tuple:
         """
         Move particle using Velocity Verlet algorithm
 
         The Nose-Hoover thermostat calculations are taken from here:
         http://www2.ph.ed.ac.uk/~dmarendu/MVP/MVP03.pdf
+
+        With respa_steps (k) > 1, this uses the impulse form of r-RESPA (Tuckerman,
+        Berne and Martyna, J. Chem. Phys. 97, 1990 (1992)): steps are taken with the
+        force of only the underlying FES (and the thermostat), and the bias force is
+        applied as a kick of half of k time steps at the start and the end of each
+        cycle of k steps. The sum of the hills is then only differentiated about
+        twice per cycle (or less, between added hills) instead of every step.
         :param float time: number of time steps to move
         :param bool return_prev: Also return starting location and velocity (before
         movement)
@@ -179,40 +436,71 @@ class Particle(object):
         time_step = self._time_step_size * time
         prev_position = self._position
         prev_velocity = self._velocity
-        prev_acceleration = self.acceleration
+        if self._respa_steps == 1:
+            self._verlet_step(time_step, 'total')
+        else:
+            kick = 0.5 * self._respa_steps * time_step
+            if self._respa_step == 0:
+                self._velocity = self._velocity + kick * self._acceleration('bias')
+            self._verlet_step(time_step, 'func')
+            self._respa_step = (self._respa_step + 1) % self._respa_steps
+            if self._respa_step == 0:
+                self._velocity = self._velocity + kick * self._acceleration('bias')
+        if return_prev:
+            ret_values = self._position, self._velocity, prev_position, prev_velocity
+        else:
+            ret_values = self._position, self._velocity
+        return ret_values
+
+    def _verlet_step(self, time_step: float, part: str) -> None:
+        """
+        Take one Velocity Verlet step (with the Nose-Hoover thermostat, if any)
+
+        :param time_step: size of the step
+        :param part: part of the FES whose force to use (see _acceleration)
+        :return: None
+        """
+        prev_position = self._position
+        prev_velocity = self._velocity
+        prev_acceleration = self._acceleration(part)
         prev_fric = self._fric
-        self.frics.append(prev_fric)
+        self._accelerations = {}
         if self._temp:
             self._position = prev_position + prev_velocity * time_step + \
                 0.5 * (prev_acceleration - prev_fric * prev_velocity) * time_step**2
+            reflected = self._constrain_position()
             self._fric = prev_fric - \
                 0.5 * time_step / self._nhc * ((1+self.dimensionality)*self._temp -
-                                               self._mass * prev_velocity**2) + \
-                0.25 * time_step**2 / self._nhc * self._mass * prev_velocity * \
-                    (prev_acceleration - prev_velocity * prev_fric) + \
+                                               self._mass * np.sum(prev_velocity**2)) + \
+                0.25 * time_step**2 / self._nhc * self._mass * np.dot(
+                    prev_velocity, prev_acceleration - prev_velocity * prev_fric) + \
                 0.0625 * time_step**3 / self._nhc * self._mass * \
-                    (prev_acceleration - prev_velocity * prev_fric)**2
+                    np.sum((prev_acceleration - prev_velocity * prev_fric)**2)
             self._velocity = (prev_velocity * (2 - time_step * prev_fric) + time_step *
-                              (prev_acceleration + self.acceleration)) / \
+                              (prev_acceleration +
+                               self._mirrored_acceleration(part, reflected))) / \
                 (2 + time_step * self._fric)
+            self._fric_integral += 0.5 * time_step * (prev_fric + self._fric)
         else:
             self._position = prev_position + prev_velocity * time_step + \
                 0.5 * prev_acceleration * time_step ** 2
+            reflected = self._constrain_position()
             self._velocity = prev_velocity + 0.5 * time_step * \
-                (prev_acceleration + self.acceleration)
-        if return_prev:
-            ret_values = self._position, self._velocity, prev_position, prev_velocity
-        else:
-            ret_values = self._position, self._velocity
-        return ret_values
+                (prev_acceleration + self._mirrored_acceleration(part, reflected))
+        if reflected is not None:
+            self._velocity = self._as_vector(
+                np.where(reflected, -self._velocity, self._velocity))
 
-    def add_hill(self):
+    def add_hill(self, height: float=None):
         """
         Add metad hill to FES
 
+        :param height: height of the hill (default: the height of the FES)
         :return:
         """
-        self._FES.add_hill(self.position)
+        bias = self.bias
+        self._FES.add_hill(*self._fes_args(self.position), height=height)
+        self._hill_energy += self.bias - bias
 
     # I'm not sure if this is the best way to pass through functions, but it should work.
     # Passing lambdas back might be better. Not sure if either will help with
@@ -0,0 +1,147 @@
+"""
+This defines some common model potentials with closed-form derivatives.
+
+Each function here returns a (func, deriv) pair that can be given to a FES, e.g.
+
+    func, deriv = double_well(barrier=2.)
+    fes = FES.MetadFES1D(func, width, height, deriv=deriv)
+
+func can still be checked against (or differentiated by) autograd; deriv uses
+plain numpy. Both work on scalars or arrays, and both can be pickled (they are
+partials of module-level functions), so a FES using them can be sent to other
+processes.
+
+Copyright (C) 2017 Thomas John Heavey IV
+
+This program is free software: you can redistribute it and/or modify it under the terms of the
+GNU General Public License as published by the Free Software Foundation, either version 3 of
+the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with this program. If
+not, see http://www.gnu.org/licenses/.
+"""
+
+import functools
+import sys
+import numpy as np
+from typing import Tuple, Callable
+
+
+def _double_well(x, barrier, minimum, tilt):
+    return barrier * ((x / minimum)**2 - 1.)**2 + tilt * x
+
+
+def _double_well_deriv(x, barrier, minimum, tilt):
+    u = x / minimum
+    return 4. * barrier / minimum * u * (u**2 - 1.) + tilt
+
+
+def double_well(barrier: float=1., minimum: float=1.,
+                tilt: float=0.) -> Tuple[Callable, Callable]:
+    """
+    Symmetric quartic double well, optionally tilted
+
+    V(x) = barrier * ((x / minimum)**2 - 1)**2 + tilt * x
+
+    :param barrier: height of the barrier at x = 0 (for no tilt)
+    :param minimum: location of the minima at +/- minimum (for no tilt)
+    :param tilt: slope of an added linear term
+    :return: function and its derivative
+    """
+    params = dict(barrier=barrier, minimum=minimum, tilt=tilt)
+    return (functools.partial(_double_well, **params),
+            functools.partial(_double_well_deriv, **params))
+
+
+def _triple_well(x, barrier, scale, tilt):
+    u = scale * x
+    return barrier / 4. * u**2 * (u**2 - 3.)**2 + tilt * x
+
+
+def _triple_well_deriv(x, barrier, scale, tilt):
+    u = scale * x
+    return 1.5 * barrier * scale * u * (u**2 - 3.) * (u**2 - 1.) + tilt
+
+
+def triple_well(barrier: float=1., minimum: float=np.sqrt(3.),
+                tilt: float=0.) -> Tuple[Callable, Callable]:
+    """
+    Sextic triple well with minima of equal depth, optionally tilted
+
+    With u = sqrt(3) * x / minimum,
+    V(x) = barrier / 4 * u**2 * (u**2 - 3)**2 + tilt * x
+
+    which has minima at 0 and +/- minimum and barriers of height barrier at
+    +/- minimum / sqrt(3).
+
+    :param barrier: height of the barriers (for no tilt)
+    :param minimum: location of the outer minima (for no tilt)
+    :param tilt: slope of an added linear term
+    :return: function and its derivative
+    """
+    params = dict(barrier=barrier, scale=np.sqrt(3.) / minimum, tilt=tilt)
+    return (functools.partial(_triple_well, **params),
+            functools.partial(_triple_well_deriv, **params))
+
+
+# Parameters of the Mueller-Brown potential (Theor. Chim. Acta 53, 75 (1979))
+_MB_A = np.array([-200., -100., -170., 15.])
+_MB_a = np.array([-1., -1., -6.5, 0.7])
+_MB_b = np.array([0., 0., 11., 0.6])
+_MB_c = np.array([-10., -10., -6.5, 0.7])
+_MB_x0 = np.array([1., 0., -0.5, -1.])
+_MB_y0 = np.array([0., 0.5, 1.5, 1.])
+
+
+def _mb_components(x, start, direction, scale, numpy):
+    dx = start[0] + direction[0] * numpy.expand_dims(x, -1) - _MB_x0
+    dy = start[1] + direction[1] * numpy.expand_dims(x, -1) - _MB_y0
+    exponent = _MB_a * dx**2 + _MB_b * dx * dy + _MB_c * dy**2
+    return dx, dy, scale * _MB_A * numpy.exp(exponent)
+
+
+def _numpy_for(x):
+    """numpy, or autograd.numpy if x is being traced by autograd"""
+    tracer = sys.modules.get('autograd.tracer')
+    if tracer is not None and isinstance(x, tracer.Box):
+        import autograd.numpy as anp
+        return anp
+    return np
+
+
+def _muller_brown_cut(x, start, direction, scale):
+    numpy = _numpy_for(x)
+    return numpy.sum(_mb_components(x, start, direction, scale, numpy)[2], axis=-1)
+
+
+def _muller_brown_cut_deriv(x, start, direction, scale):
+    dx, dy, terms = _mb_components(x, start, direction, scale, np)
+    d_x, d_y = direction
+    d_exponent = (2. * _MB_a * dx * d_x + _MB_b * (dx * d_y + dy * d_x) +
+                  2. * _MB_c * dy * d_y)
+    return np.sum(terms * d_exponent, axis=-1)
+
+
+def muller_brown_cut(start: Tuple[float, float]=(-0.558, 1.442),
+                     end: Tuple[float, float]=(0.623, 0.028),
+                     scale: float=1.) -> Tuple[Callable, Callable]:
+    """
+    1D cut through the Mueller-Brown potential along a straight line
+
+    The coordinate x parametrizes the line from start (x = 0) to end (x = 1). The
+    defaults go between the two deepest minima, passing near the intermediate one.
+
+    :param start: (x, y) point of the 2D surface at x = 0
+    :param end: (x, y) point of the 2D surface at x = 1
+    :param scale: factor multiplying the energy
+    :return: function and its derivative
+    """
+    start = np.asarray(start, dtype=float)
+    params = dict(start=start, direction=np.asarray(end, dtype=float) - start,
+                  scale=scale)
+    return (functools.partial(_muller_brown_cut, **params),
+            functools.partial(_muller_brown_cut_deriv, **params))
@@ -0,0 +1,251 @@
+"""
+Defines a Reweighter class for unbiasing metadynamics trajectories.
+
+Copyright (C) 2017 Thomas John Heavey IV
+
+This program is free software: you can redistribute it and/or modify it under the terms of the
+GNU General Public License as published by the Free Software Foundation, either version 3 of
+the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with this program. If
+not, see http://www.gnu.org/licenses/.
+"""
+
+import math
+import numpy as np
+from typing import Tuple, Iterator
+
+
+class Reweighter(object):
+    """
+    Reweight frames of a 1D metadynamics trajectory to the unbiased ensemble
+
+    Uses the time-dependent weights of Tiwary and Parrinello (J. Phys. Chem. B 119,
+    736 (2015)): w(t) = exp[(V(s(t), t) - c(t)) / kT] where V is the bias at the
+    time of the frame and c(t) is its time-dependent offset.
+
+    The trajectory is processed in chunks of frames, in order, so that it can be
+    much larger than memory (e.g. a np.memmap or np.load(..., mmap_mode='r')).
+    The bias is kept on a grid: each hill costs O(grid points) and each frame
+    O(1), by interpolating in the grid of the bias as it was at that frame.
+    Positions beyond the grid use the bias at its edge. For a periodic collective
+    variable, the grid covers the period and wraps around.
+    """
+
+    # maximum number of hills added to the grid per chunk of frames
+    _max_chunk_hills = 1024
+
+    def __init__(self, hill_centers, hill_frames, width: float, height: float,
+                 temp: float, grid_range: Tuple[float, float]=None,
+                 grid_points: int=2000, bias_factor: float=None,
+                 chunk_size: int=2**16, period: Tuple[float, float]=None):
+        """
+
+        :param hill_centers: centers of the hills in order of addition
+        :param hill_frames: first trajectory frame on which each hill acts
+        :param width: width (sigma) of the Gaussian hills
+        :param height: height of the Gaussian hills, or of each hill
+        :param temp: temperature in units of (1 / k_b)
+        :param grid_range: minimum and maximum of the grid for the bias and c(t).
+        It should cover all sampled positions. Default is the range of the hill
+        centers expanded by five widths.
+        :param grid_points: number of points in the grid
+        :param bias_factor: bias factor (gamma) for well-tempered metadynamics.
+        None (the default) is for standard metadynamics.
+        :param chunk_size: number of frames to process at a time
+        :param period: minimum and maximum of the domain of a periodic collective
+        variable, in which case the grid covers it (grid_range is not used) and
+        hills are evaluated at their minimum image
+        """
+        self._centers = np.asarray(hill_centers, dtype=float).ravel()
+        self._frames = np.asarray(hill_frames, dtype=int).ravel()
+        if self._centers.shape != self._frames.shape:
+            raise ValueError('hill_centers and hill_frames must be the same length')
+        if np.any(np.diff(self._frames) < 0):
+            raise ValueError('hill_frames must be in increasing order')
+        if not temp:
+            raise ValueError('A (non-zero) temperature is needed for reweighting')
+        self._width = float(width)
+        self._heights = np.broadcast_to(np.asarray(height, dtype=float),
+                                        self._centers.shape)
+        self._beta = 1. / float(temp)
+        self._bias_factor = bias_factor
+        self._chunk_size = int(chunk_size)
+        self._period = period
+        if period is not None:
+            self._grid = np.linspace(*period, grid_points, endpoint=False)
+        else:
+            if grid_range is None:
+                if len(self._centers):
+                    grid_range = (self._centers.min() - 5. * self._width,
+                                  self._centers.max() + 5. * self._width)
+                else:
+                    grid_range = (-1., 1.)
+            self._grid = np.linspace(*grid_range, grid_points)
+
+    @classmethod
+    def from_simulation(cls, simulation, temp: float=None, **kwargs) -> 'Reweighter':
+        """
+        Create a Reweighter for the last run of a 1D metadynamics Simulation
+
+        Hills that were already on the FES before that run act from frame 0.
+        :param Simulation.Simulation simulation: the simulation that has been run
+        :param temp: temperature. Default is that of the Particle's thermostat.
+        :param kwargs: other arguments for Reweighter
+        :return: the Reweighter
+        """
+        particle = simulation.particle
+        fes = particle.fes
+        if not fes.metad:
+            raise ValueError('Only metadynamics simulations can be reweighted')
+        if fes.dimensionality != 1:
+            raise NotImplementedError('Only 1D reweighting is implemented')
+        centers = fes.hill_centers
+        run_frames = simulation.hill_frames
+        frames = np.concatenate((np.zeros(len(centers) - len(run_frames), dtype=int),
+                                 run_frames))
+        kwargs.setdefault('period', fes.period)
+        return cls(centers, frames, fes.width, fes.hill_heights,
+                   temp=particle.temp if temp is None else temp, **kwargs)
+
+    def _hills(self, x: np.ndarray, first: int, last: int) -> np.ndarray:
+        """
+        Values of each of a range of hills at each location
+
+        :param x: locations
+        :param first: index of the first hill
+        :param last: index after the last hill
+        :return: array (locations x hills)
+        """
+        diff = x[:, np.newaxis] - self._centers[first:last]
+        if self._period is not None:
+            length = self._period[1] - self._period[0]
+            diff -= length * np.round(diff / length)
+        return (self._heights[first:last] / (self._width * math.sqrt(2. * math.pi)) *
+                np.exp(-0.5 * (diff / self._width)**2))
+
+    def _offset(self, grid_biases: np.ndarray) -> np.ndarray:
+        """
+        c(t) for biases on the grid
+
+        :param grid_biases: array (bias states x grid points)
+        :return: c for each bias state
+        """
+        from scipy.special import logsumexp
+        beta_v = self._beta * grid_biases
+        if self._bias_factor is None:
+            log_ratio = logsumexp(beta_v, axis=1) - math.log(grid_biases.shape[1])
+        else:
+            gamma = self._bias_factor
+            log_ratio = (logsumexp(gamma / (gamma - 1.) * beta_v, axis=1) -
+                         logsumexp(beta_v / (gamma - 1.), axis=1))
+        return log_ratio / self._beta
+
+    def iter_log_weights(self, positions) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Iterate over chunks of positions and their log reweighting factors
+
+        :param positions: positions of every frame (n frames, or n x 1), e.g.
+        Simulation.positions or a memory-mapped array
+        :return: iterator of (positions, log weights) for consecutive chunks
+        """
+        n_frames = len(positions)
+        grid = self._grid
+        spacing = grid[1] - grid[0]
+        grid_bias = np.zeros_like(grid)
+        # hills acting from before the first frame go straight onto the grid
+        k = int(np.searchsorted(self._frames, 0, side='right'))
+        for start in range(0, k, self._max_chunk_hills):
+            stop = min(k, start + self._max_chunk_hills)
+            grid_bias += self._hills(grid, start, stop).sum(axis=1)
+        start = 0
+        while start < n_frames:
+            stop = min(n_frames, start + self._chunk_size)
+            if k + self._max_chunk_hills < len(self._frames):
+                stop = min(stop, max(start + 1, self._frames[k + self._max_chunk_hills]))
+            k_stop = int(np.searchsorted(self._frames, stop, side='left'))
+            x = np.asarray(positions[start:stop], dtype=float).reshape(stop - start)
+            # bias on the grid after each hill added during this chunk
+            grid_biases = grid_bias + np.concatenate(
+                (np.zeros((1, len(grid))),
+                 np.cumsum(self._hills(grid, k, k_stop).T, axis=0)))
+            # number of those hills acting on each frame
+            n_acting = np.searchsorted(self._frames[k:k_stop],
+                                       np.arange(start, stop), side='right')
+            # linear interpolation in the bias state of each frame
+            if self._period is None:
+                index = np.clip((x - grid[0]) / spacing, 0., len(grid) - 1.)
+                i_low = np.minimum(index.astype(int), len(grid) - 2)
+                i_high = i_low + 1
+            else:
+                index = ((x - grid[0]) / spacing) % len(grid)
+                i_low = np.minimum(index.astype(int), len(grid) - 1)
+                i_high = (i_low + 1) % len(grid)
+            frac = index - i_low
+            bias = ((1. - frac) * grid_biases[n_acting, i_low] +
+                    frac * grid_biases[n_acting, i_high])
+            offsets = self._offset(grid_biases)[n_acting]
+            yield x, self._beta * (bias - offsets)
+            grid_bias = grid_biases[-1]
+            k = k_stop
+            start = stop
+
+    def weights(self, positions) -> np.ndarray:
+        """
+        Reweighting factors for every frame
+
+        Only relative weights matter, so they are scaled to a maximum of one.
+        :param positions: positions of every frame
+        :return: weights (n frames)
+        """
+        log_w = np.concatenate([log_w for _, log_w in self.iter_log_weights(positions)])
+        return np.exp(log_w - log_w.max())
+
+    def histogram(self, positions, bins: int=100,
+                  range_: Tuple[float, float]=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Unbiased, normalized histogram of the positions
+
+        :param positions: positions of every frame
+        :param bins: number of bins
+        :param range_: minimum and maximum of the histogram. Default is the grid range
+        (or the period).
+        :return: probability densities and bin edges
+        """
+        if range_ is None:
+            range_ = self._period or (self._grid[0], self._grid[-1])
+        edges = np.linspace(*range_, bins + 1)
+        hist = np.zeros(bins)
+        # the histogram is kept scaled by exp(-log_ref) to avoid overflow/underflow
+        log_ref = -np.inf
+        for x, log_w in self.iter_log_weights(positions):
+            chunk_max = log_w.max()
+            if chunk_max > log_ref:
+                hist *= np.exp(log_ref - chunk_max)
+                log_ref = chunk_max
+            hist += np.histogram(x, bins=edges, weights=np.exp(log_w - log_ref))[0]
+        total = hist.sum()
+        if total > 0:
+            hist /= total * np.diff(edges)
+        return hist, edges
+
+    def free_energy(self, positions, bins: int=100,
+                    range_: Tuple[float, float]=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Unbiased free energy profile from the positions
+
+        :param positions: positions of every frame
+        :param bins: number of bins
+        :param range_: minimum and maximum of the profile. Default is the grid range.
+        :return: free energies (minimum set to zero, inf for empty bins) and bin
+        centers
+        """
+        hist, edges = self.histogram(positions, bins=bins, range_=range_)
+        with np.errstate(divide='ignore'):
+            fes = - np.log(hist) / self._beta
+        fes -= fes[np.isfinite(fes)].min()
+        return fes, 0.5 * (edges[1:] + edges[:-1])
@@ -18,13 +18,111 @@ not, see http://www.gnu.org/licenses/.
 from . import Particle
 from . import FES
 import numpy as np
-import matplotlib.pyplot as plt
+from typing import Callable, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
+    from . import Deposition
+
+
+def minmax_envelope(data, n_bins: int, chunk_size: int=2**20
+                    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Minimum and maximum of consecutive blocks of frames of a 1D series
+
+    The data are read chunk_size frames at a time, so this also works on
+    memory-mapped arrays much larger than memory.
+    :param data: values for each frame (n frames, or n x 1)
+    :param n_bins: (approximate) number of blocks to split the frames into
+    :param chunk_size: (approximate) number of frames to read at a time
+    :return: middle frame, minimum, and maximum of each block
+    """
+    n_frames = len(data)
+    bin_size = max(1, -(-n_frames // n_bins))
+    step = bin_size * max(1, chunk_size // bin_size)
+    mins, maxs = [], []
+    for start in range(0, n_frames, step):
+        stop = min(n_frames, start + step)
+        chunk = np.asarray(data[start:stop], dtype=float).reshape(stop - start)
+        n_full = len(chunk) // bin_size * bin_size
+        blocks = chunk[:n_full].reshape(-1, bin_size)
+        mins.append(blocks.min(axis=1))
+        maxs.append(blocks.max(axis=1))
+        if n_full < len(chunk):
+            mins.append(chunk[n_full:].min(keepdims=True))
+            maxs.append(chunk[n_full:].max(keepdims=True))
+    mins, maxs = np.concatenate(mins), np.concatenate(maxs)
+    frames = np.minimum(np.arange(len(mins)) * bin_size + (bin_size - 1) / 2.,
+                        n_frames - 1)
+    return frames, mins, maxs
+
+
+def plot_positions(positions, max_points: int=None, bins: int=200,
+                   chunk_size: int=2**20, **kwargs) -> 'plt.figure':
+    """
+    Plot positions from a trajectory (in memory or memory-mapped)
+
+    A 1D trajectory is plotted as position against time step; a 2D one as y
+    against x.
+
+    :param positions: positions (n frames x dimensionality)
+    :param max_points: If given and there are more frames than this, draw a
+    decimated plot instead of every frame, so that the cost of the figure does not
+    depend on the length of the trajectory. In 1D the min/max envelope of blocks of
+    frames is filled (max_points blocks); in 2D a histogram of the visited positions
+    is drawn.
+    :param bins: number of bins per dimension for the decimated 2D histogram
+    :param chunk_size: number of frames to read at a time when decimating
+    :param kwargs: arguments to be passed to the plot function
+    :return: figure object of the plot
+    """
+    import matplotlib.pyplot as plt
+    n_frames = len(positions)
+    dimension = 1 if np.ndim(positions) == 1 else positions.shape[1]
+    decimate = max_points is not None and n_frames > max_points
+    fig, ax = plt.subplots()
+    if dimension == 1:
+        if decimate:
+            frames, mins, maxs = minmax_envelope(positions, max_points, chunk_size)
+            kwargs.setdefault('linewidth', 0)
+            ax.fill_between(frames, mins, maxs, **kwargs)
+        else:
+            ax.plot(positions, **kwargs)
+        ax.set_xlabel('time step')
+        ax.set_ylabel('$x$')
+    elif dimension == 2:
+        if decimate:
+            chunks = [(start, min(n_frames, start + chunk_size))
+                      for start in range(0, n_frames, chunk_size)]
+            lows, highs = zip(*((np.min(positions[a:b], axis=0),
+                                 np.max(positions[a:b], axis=0)) for a, b in chunks))
+            low, high = np.min(lows, axis=0), np.max(highs, axis=0)
+            edges = [np.linspace(low[i], high[i], bins + 1) for i in range(2)]
+            hist = np.zeros((bins, bins))
+            for a, b in chunks:
+                chunk = np.asarray(positions[a:b], dtype=float)
+                hist += np.histogram2d(chunk[:, 0], chunk[:, 1], bins=edges)[0]
+            kwargs.setdefault('cmap', 'Greys')
+            mesh = ax.pcolormesh(edges[0], edges[1],
+                                 np.ma.masked_equal(hist.T, 0), **kwargs)
+            fig.colorbar(mesh, ax=ax, label='frames')
+        else:
+            ax.plot(positions[:, 0], positions[:, 1], **kwargs)
+        ax.set_xlabel('$x$')
+        ax.set_ylabel('$y$')
+    else:
+        raise NotImplementedError
+    fig.tight_layout()
+    return fig
 
 
 class Simulation(object):
     """"""
 
-    def __init__(self, dimension=None, particle=None, fes=None, metad_freq: int=5):
+    def __init__(self, dimension=None, particle=None, fes=None, metad_freq: int=5,
+                 dtype=np.float64, stride: int=1, record_bias: bool=False,
+                 record_hills: bool=False, record_energy: bool=False,
+                 scheduler: 'Deposition.Scheduler'=None):
         """
 
         :param int dimension: Dimensionality of the simulation. Currently either 1 or 2.
@@ -36,14 +134,35 @@ class Simulation(object):
         :param FES.FES fes: FES to use for the simulation as passed to Particle.
 
         If a Particle is provided, this argument is ignored.
-        :param bool metad: Do simulation with metadynamics. Default is False.
+        :param int metad_freq: number of steps between added hills (for a
+        metadynamics FES)
+        :param dtype: floating point type in which to store the trajectory (e.g.
+        np.float32 to halve the memory needed)
+        :param int stride: number of steps between recorded frames
+        :param bool record_bias: also record the bias energy at each frame
+        :param bool record_hills: also record for each frame whether any hills were
+        added since the previous frame
+        :param bool record_energy: also record the conserved energy of the Particle
+        at each frame (in double precision), to check the integration
+        :param Deposition.Scheduler scheduler: decides every metad_freq steps whether
+        to add a hill and how tall (default: always, at the height of the FES)
         """
         self._dimension: int = None
         self._particle: Particle.Particle = None
         self._FES: FES.FES = None
         self._metad: bool = None
         self._metad_freq = metad_freq
-        self._trajectory: np.array = None
+        self._dtype = np.dtype(dtype)
+        self._stride = int(stride)
+        self._record_bias = record_bias
+        self._record_hills = record_hills
+        self._record_energy = record_energy
+        self._energy_drift: float = None
+        self._run_time: float = None
+        self._records: np.ndarray = None
+        self._hill_steps: np.array = None
+        self._hill_since_record = False
+        self._scheduler = scheduler
 
         if dimension is not None:
             self._dimension = dimension
@@ -83,17 +202,66 @@ class Simulation(object):
     def particle(self, particle):
         self._particle = particle
 
+    @property
+    def stride(self) -> int:
+        """
+        Number of steps between recorded frames
+
+        :return: the stride
+        """
+        return self._stride
+
+    @stride.setter
+    def stride(self, value):
+        raise AttributeError('stride can only be set when creating the Simulation')
+
+    @property
+    def scheduler(self) -> 'Deposition.Scheduler':
+        """
+        Scheduler deciding which hills to add, if any
+
+        :return: the scheduler
+        """
+        return self._scheduler
+
+    @property
+    def metad_freq(self) -> int:
+        """
+        Number of steps between added hills
+
+        :return: the frequency
+        """
+        return self._metad_freq
+
+    @property
+    def records(self) -> np.ndarray:
+        """
+        Structured array with one record per recorded frame
+
+        The fields are position and velocity (each with one element per
+        dimension), friction, and, if requested, bias and hill.
+        :return: the records
+        """
+        if self._records is None:
+            print('No trajectory data yet! Have you run yet?')
+        return self._records
+
+    @records.setter
+    def records(self, value):
+        raise AttributeError('Cannot directly set the records')
+
     @property
     def trajectory(self) -> np.array:
         """
         Trajectory of the particle
 
-        :return: trajectory (n x 2)
+        This is a copy of the positions and velocities from records.
+        :return: trajectory (n x 2 * dimension)
         :rtype: np.array
         """
-        if self._trajectory is None:
+        if self._records is None:
             print('No trajectory data yet! Have you run yet?')
-        return self._trajectory
+        return np.hstack((self.positions, self.velocities))
 
     @trajectory.setter
     def trajectory(self, value):
@@ -107,9 +275,9 @@ class Simulation(object):
 
         :return: the positions
         """
-        if self._trajectory is None:
+        if self._records is None:
             print('No trajectory data yet! Have you run yet?')
-        return self.trajectory[:, 0:self._dimension]
+        return self.records['position']
 
     @positions.setter
     def positions(self, value):
@@ -122,32 +290,118 @@ class Simulation(object):
 
         :return: the velocities
         """
-        if self._trajectory is None:
+        if self._records is None:
             print('No trajectory data yet! Have you run yet?')
-        dim = self._dimension
-        return self.trajectory[:, dim:2*dim]
+        return self.records['velocity']
 
     @velocities.setter
     def velocities(self, value):
         raise AttributeError('Cannot directly set velocities or trajectory')
 
+    @property
+    def frictions(self) -> np.array:
+        """
+        Nose-Hoover friction from the trajectory
+
+        :return: the frictions
+        """
+        if self._records is None:
+            print('No trajectory data yet! Have you run yet?')
+        return self.records['friction']
+
+    @frictions.setter
+    def frictions(self, value):
+        raise AttributeError('Cannot directly set frictions or trajectory')
+
+    @property
+    def hill_frames(self) -> np.array:
+        """
+        Trajectory frames at which hills were added during the last run
+
+        Each hill acts on this frame and all later ones.
+        :return: the frame indices
+        """
+        if self._hill_steps is None:
+            print('No trajectory data yet! Have you run yet?')
+        return -(-self._hill_steps // self._stride)
+
+    @hill_frames.setter
+    def hill_frames(self, value):
+        raise AttributeError('Cannot directly set hill_frames')
+
+    @property
+    def energy_drift(self) -> float:
+        """
+        Change in the conserved energy of the Particle per unit time over the last run
+
+        This measures the error of the integration, e.g. to choose the largest
+        time step or respa_steps that is accurate enough (see
+        Particle.conserved_energy). For a simulation extended with runs that
+        continued it (see extend), this is over all of them.
+        :return: the drift, or None if not yet run
+        """
+        return self._energy_drift
+
     # Running Simulation #####################
 
+    def _record_dtype(self) -> np.dtype:
+        """
+        Data type of the per-frame records
+
+        :return: structured dtype
+        """
+        fields = [('position', self._dtype, (self._dimension,)),
+                  ('velocity', self._dtype, (self._dimension,)),
+                  ('friction', self._dtype)]
+        if self._record_bias:
+            fields.append(('bias', self._dtype))
+        if self._record_hills:
+            fields.append(('hill', np.bool_))
+        if self._record_energy:
+            fields.append(('energy', np.float64))
+        return np.dtype(fields)
+
+    def _record(self, frame: int) -> None:
+        """
+        Record the current state of the particle as a frame
+
+        :param frame: index of the frame
+        :return: nothing
+        """
+        record = self._records[frame]
+        record['position'] = self.particle.position
+        record['velocity'] = self.particle.velocity
+        record['friction'] = self.particle.fric
+        if self._record_bias:
+            record['bias'] = self.particle.bias
+        if self._record_energy:
+            record['energy'] = self.particle.conserved_energy
+        if self._record_hills:
+            record['hill'] = self._hill_since_record
+            self._hill_since_record = False
+
     def _time_step(self, step_num):
         """
-        Move the particle and append position to trajectory
+        Move the particle and record it if this step is a recorded frame
         :return: nothing
         """
-        new_position, new_velocity = self.particle.move(1)
-        self.trajectory[step_num] = new_position, new_velocity
+        self.particle.move(1)
+        if step_num % self._stride == 0:
+            self._record(step_num // self._stride)
 
-    def run(self, steps: int =1000, status_int: int=1000) -> None:
+    def run(self, steps: int =1000, status_int: int=1000,
+            callback: Callable[[int], None]=None, callback_int: int=1000,
+            verbose: bool=True) -> None:
         """
         Run the simulation for a number of steps
 
         If no self.particle is yet defined, a default will be used
         :param steps: number of steps for simulation
         :param status_int: number of steps between reporting progress
+        :param callback: function called with the step number every callback_int
+        steps (after that step), e.g. to monitor the run
+        :param callback_int: number of steps between calls of callback
+        :param verbose: print the energy drift (and scheduler report) at the end
         :return: nothing
         """
         if self.particle is None:
@@ -155,45 +409,89 @@ class Simulation(object):
             # todo put in default particle here
             pass
         self._metad = self.particle.metad
-        self._trajectory = np.zeros((steps+1, 2*self._dimension), float)
-        self._trajectory[0] = self.particle.position, self.particle.velocity
+        self._records = np.zeros(steps // self._stride + 1, dtype=self._record_dtype())
+        self._hill_since_record = False
+        self._record(0)
+        start_energy = self.particle.conserved_energy
+        hill_steps = []
         if not self._metad:
             for i in range(1, steps+1):
                 if i % status_int == 0:
                     percent = float(i) / float(steps) * 100.
                     print(f'On step {i}, {percent:.4}% done.')
                 self._time_step(i)
+                if callback is not None and i % callback_int == 0:
+                    callback(i)
         else:
+            scheduler = self._scheduler
             for i in range(1, steps+1):
                 if i % status_int == 0:
                     percent = float(i) / float(steps) * 100.
                     print(f'On step {i}, {percent:.4}% done.')
                 if i % self._metad_freq == 0:
-                    self.particle.add_hill()
+                    height = None if scheduler is None else \
+                        scheduler.consider(self.particle)
+                    if scheduler is None or height is not None:
+                        self.particle.add_hill(height)
+                        hill_steps.append(i)
+                        self._hill_since_record = True
                 self._time_step(i)
-        print(f'Done running {steps} steps!')
+                if callback is not None and i % callback_int == 0:
+                    callback(i)
+        self._hill_steps = np.array(hill_steps, dtype=int)
+        self._run_time = steps * self.particle.time_step_size
+        self._energy_drift = (self.particle.conserved_energy - start_energy) / \
+            self._run_time
+        if not verbose:
+            return
+        print(f'Done running {steps} steps! Energy drift: '
+              f'{self._energy_drift:.3g} per unit time.')
+        if self._metad and self._scheduler is not None:
+            print(self._scheduler.report())
+
+    def extend(self, other: 'Simulation') -> None:
+        """
+        Append the frames and hills of a run that continued this one
+
+        For example, to run in blocks: run a copy of this simulation (copy.copy,
+        which continues from the same Particle), then extend this one with it. The
+        number of steps of this simulation must be a multiple of the stride and of
+        metad_freq so that frames and hills line up as in one longer run. This then
+        continues with the Particle and scheduler of the other simulation.
+        :param other: simulation that was run starting from the end of this one
+        :return: nothing
+        """
+        if self._records is None:
+            raise ValueError('This simulation has not been run yet')
+        if other.records.dtype != self._records.dtype or other.stride != self._stride:
+            raise ValueError('Can only extend with a simulation recording the same '
+                             'fields with the same stride')
+        steps_so_far = (len(self._records) - 1) * self._stride
+        self._records = np.concatenate((self._records, other.records[1:]))
+        self._hill_steps = np.concatenate((self._hill_steps,
+                                           other._hill_steps + steps_so_far))
+        run_time = self._run_time + other._run_time
+        self._energy_drift = (self._energy_drift * self._run_time +
+                              other._energy_drift * other._run_time) / run_time
+        self._run_time = run_time
+        self.particle = other.particle
+        self._scheduler = other._scheduler
 
     # Analysis and Plotting #####################
 
-    def plot_trajectory(self, **kwargs) -> plt.figure:
+    def plot_trajectory(self, max_points: int=None, **kwargs) -> 'plt.figure':
         """
         Plot the trajectory on a scatter plot
 
         If it's a 2D trajectory, the axes will be the two dimensions.
         If it's a 1D trajectory, it will be the position as a function of time.
 
+        :param max_points: If given, decimate trajectories longer than this (see
+        plot_positions)
         :param kwargs: arguments to be passed to the plot function
         :return: figure object of the scatter plot
         """
-        fig, ax = plt.subplots()
-        if self._dimension == 1:
-            ax.plot(self.positions, **kwargs)
-            ax.set_xlabel('time step')
-            ax.set_ylabel('$x$')
-            fig.tight_layout()
-            return fig
-        else:
-            raise NotImplementedError
+        return plot_positions(self.positions, max_points=max_points, **kwargs)
 
     def plot_hills(self, **kwargs): return self.particle.plot_hills(**kwargs)
 
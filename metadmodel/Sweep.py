@@ -0,0 +1,256 @@
+"""
+Defines a Sweep class for running simulations over a grid of parameters.
+
+Copyright (C) 2017 Thomas John Heavey IV
+
+This program is free software: you can redistribute it and/or modify it under the terms of the
+GNU General Public License as published by the Free Software Foundation, either version 3 of
+the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with this program. If
+not, see http://www.gnu.org/licenses/.
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import random
+import numpy as np
+from typing import Callable, Dict, List, Sequence, Tuple
+
+
+def metad_job(steps: int=10000, width: float=0.1, height: float=0.1,
+              metad_freq: int=5, temp: float=0.5, nh_const: float=1.,
+              time_step_size: float=0.01, mass: float=1., x0: float=1.,
+              potential: str='double_well',
+              analysis_range: Tuple[float, float]=(-2., 2.),
+              basins: Tuple[Tuple[float, float], Tuple[float, float]]=(
+                  (-1.5, -0.5), (0.5, 1.5)),
+              **potential_kwargs) -> dict:
+    """
+    Run a 1D metadynamics simulation and summarize it
+
+    :param steps: number of steps to run
+    :param width: width of the hills
+    :param height: height of the hills
+    :param metad_freq: steps between added hills
+    :param temp: temperature
+    :param nh_const: Nose-Hoover thermostat constant
+    :param time_step_size: size of the time steps
+    :param mass: mass of the particle
+    :param x0: starting position
+    :param potential: name of a function in the Potentials module
+    :param analysis_range: range of the grid for the running FES estimate
+    :param basins: ranges of the two basins used for delta_g and transitions
+    :param potential_kwargs: arguments for the potential function
+    :return: summary of the run
+    """
+    from . import FES, Particle, Potentials, Simulation
+    func, deriv = getattr(Potentials, potential)(**potential_kwargs)
+    # the built-in potentials' derivatives are known to be right, so skip the
+    # check (which would import autograd in every worker)
+    fes = FES.MetadFES1D(func, width, height, deriv=deriv, check_deriv=False,
+                         analysis_range=analysis_range,
+                         snapshot_stride=max(1, steps // metad_freq // 20))
+    particle = Particle.Particle(fes, x0, temp=temp, nh_const=nh_const,
+                                 mass=mass, time_step_size=time_step_size)
+    sim = Simulation.Simulation(particle=particle, metad_freq=metad_freq)
+    sim.run(steps, status_int=steps + 1, verbose=False)
+    positions = sim.positions[:, 0]
+    basin_a, basin_b = basins
+    # label frames by the last basin visited to count transitions between them
+    labels = np.where((positions >= basin_a[0]) & (positions <= basin_a[1]), -1,
+                      np.where((positions >= basin_b[0]) & (positions <= basin_b[1]),
+                               1, 0))
+    visited = labels[labels != 0]
+    rms = fes.convergence_rms()
+    return dict(n_hills=len(fes.hill_centers),
+                transitions=int(np.count_nonzero(np.diff(visited))),
+                mean_position=float(positions.mean()),
+                std_position=float(positions.std()),
+                delta_g=float(fes.delta_g(basin_a, basin_b, temp=temp)[-1])
+                if len(fes.snapshot_hills) else None,
+                final_rms_change=float(rms[-1]) if len(rms) else None)
+
+
+def remd_job(size: int=4, n_steps: int=10000, interval: int=10,
+             start_temp: float=300., scaling_exponent: float=0.05,
+             width_param: float=5.) -> dict:
+    """
+    Run a replica exchange simulation and summarize it
+
+    :param size: number of replicas
+    :param n_steps: number of steps
+    :param interval: steps between exchange attempts
+    :param start_temp: lowest temperature
+    :param scaling_exponent: exponent of the geometric temperature ladder
+    :param width_param: width parameter of the walker energy distributions
+    :return: summary of the run
+    """
+    import remd_model
+    sim = remd_model.Simulation(size, n_steps, interval, start_temp=start_temp,
+                                scaling_exponent=scaling_exponent,
+                                width_param=width_param)
+    sim.run()
+    r_states = sim.r_states
+    swaps = np.count_nonzero(np.diff(r_states, axis=0)) // 2
+    attempts = (n_steps // interval) * (size - 1) / 2.
+    # round trips: pairs of visits to opposite ends of the ladder, per walker
+    round_trips = 0
+    for walker_states in r_states.T:
+        ends = walker_states[(walker_states == 0) | (walker_states == size - 1)]
+        round_trips += int(np.count_nonzero(np.diff(ends))) // 2
+    return dict(swaps=int(swaps),
+                acceptance=float(swaps / attempts) if attempts else None,
+                round_trips=round_trips)
+
+
+def _to_builtin(value):
+    """Convert numpy values so that they can be written as JSON"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f'Cannot convert {type(value)} to JSON')
+
+
+def _run_point(job: Callable, params: dict, seed: int) -> dict:
+    """
+    Seed the random number generators and run one job (in a worker process)
+
+    :param job: function to run
+    :param params: arguments for the job
+    :param seed: seed for the random number generators
+    :return: summary from the job
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    return job(**params)
+
+
+class Sweep(object):
+    """
+    Run a job for every combination of a grid of parameters over a process pool
+
+    The job is a picklable (module-level) function that takes the parameters as
+    keyword arguments and returns a small dict of summary metrics, e.g. metad_job
+    or remd_job. Only these summaries are sent back from the workers.
+
+    Each result is written to its own JSON file in results_dir as soon as it is
+    done, named by a hash of its parameters, so an interrupted sweep can be run
+    again and will skip the points already done.
+    """
+
+    def __init__(self, job: Callable, grid: Dict[str, Sequence], results_dir: str,
+                 seed: int=0, processes: int=None, **fixed):
+        """
+
+        :param job: function to run for each point
+        :param grid: names of parameters and the values to sweep for each
+        :param results_dir: directory in which to store the results
+        :param seed: base seed; each point gets a seed derived from this and its
+        parameters, so results are reproducible and independent of order
+        :param processes: number of worker processes (default: number of CPUs)
+        :param fixed: parameters given to every job
+        """
+        self._job = job
+        self._grid = dict(grid)
+        self._results_dir = results_dir
+        self._seed = int(seed)
+        self._processes = processes
+        self._fixed = fixed
+        os.makedirs(results_dir, exist_ok=True)
+
+    @property
+    def points(self) -> List[dict]:
+        """
+        All combinations of the parameters (including the fixed ones)
+
+        :return: list of parameter dicts
+        """
+        names = list(self._grid)
+        return [dict(self._fixed, **dict(zip(names, values)))
+                for values in itertools.product(*(self._grid[n] for n in names))]
+
+    def _key(self, params: dict) -> str:
+        """Identifier of a point from its parameters and the job"""
+        text = json.dumps([self._job.__module__, self._job.__name__, params],
+                          sort_keys=True, default=_to_builtin)
+        return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+    def _path(self, key: str) -> str:
+        """Path of the result file for a point"""
+        return os.path.join(self._results_dir, f'{key}.json')
+
+    def _point_seed(self, key: str) -> int:
+        """Seed for a point from the base seed and the point's key"""
+        return int(np.random.SeedSequence([self._seed, int(key, 16)]
+                                          ).generate_state(1)[0])
+
+    def _save(self, key: str, record: dict) -> None:
+        """Write a result so that a partial file is never left behind"""
+        path = self._path(key)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(record, f, default=_to_builtin)
+        os.replace(path + '.tmp', path)
+
+    def run(self) -> List[dict]:
+        """
+        Run all points not already in the results directory
+
+        A point that fails does not stop the others; once they are done and
+        saved, an error is raised listing the failed points, which are run again
+        by the next call.
+        :return: all results (see results)
+        :raises RuntimeError: if any points failed (from the first failure)
+        """
+        # imported here since workers importing this package never need it
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        pending = []
+        for params in self.points:
+            key = self._key(params)
+            if not os.path.exists(self._path(key)):
+                pending.append((key, params))
+        print(f'{len(pending)} of {len(self.points)} points to run.')
+        failures = []
+        with ProcessPoolExecutor(max_workers=self._processes) as executor:
+            futures = {executor.submit(_run_point, self._job, params,
+                                       self._point_seed(key)): (key, params)
+                       for key, params in pending}
+            for i, future in enumerate(as_completed(futures), 1):
+                key, params = futures[future]
+                try:
+                    result = future.result()
+                except Exception as error:
+                    failures.append((params, error))
+                    print(f'Failed {i} of {len(pending)}: {params}: '
+                          f'{type(error).__name__}: {error}')
+                    continue
+                self._save(key, dict(params=params, seed=self._point_seed(key),
+                                     result=result))
+                print(f'Finished {i} of {len(pending)}: {params}')
+        if failures:
+            raise RuntimeError(f'{len(failures)} of {len(pending)} points failed: '
+                               f'{[params for params, _ in failures]}'
+                               ) from failures[0][1]
+        return self.results
+
+    @property
+    def results(self) -> List[dict]:
+        """
+        Results for the points of this sweep that have been run
+
+        :return: list of dicts with keys params, seed, and result
+        """
+        results = []
+        for params in self.points:
+            path = self._path(self._key(params))
+            if os.path.exists(path):
+                with open(path) as f:
+                    results.append(json.load(f))
+        return results
@@ -15,6 +15,55 @@ You should have received a copy of the GNU General Public License along with thi
 not, see http://www.gnu.org/licenses/.
 """
 
+# Importing the package happens in every worker process, so the modules only
+# import numpy and the standard library at module level. matplotlib, autograd and
+# scipy are imported where they are used. Check with check_import_budget() or:
+#     python -X importtime -c 'import metadmodel'
+# Async is not imported here, as asyncio would be (import metadmodel.Async).
+from . import Background
+from . import Deposition
 from . import FES
 from . import Particle
+from . import Potentials
+from . import Reweighting
 from . import Simulation
+from . import Sweep
+
+
+# modules too slow to import with the package (see above)
+_SLOW_MODULES = ('asyncio', 'autograd', 'concurrent.futures', 'logging', 'matplotlib',
+                 'scipy')
+
+
+def check_import_budget(budget: float=0.2, repeats: int=3) -> float:
+    """
+    Check that importing this package (with numpy) takes at most budget seconds
+
+    The import is timed in new interpreters, as this one has imported it already,
+    and the fastest of repeats imports is used to lessen the noise. If it is over
+    budget, the error also names any of the slow modules (which should only be
+    imported where they are used) that came with it.
+    :param budget: maximum time for the import in seconds
+    :param repeats: number of times to time the import
+    :return: the time measured, in seconds
+    :raises ImportError: if the import takes longer than budget
+    """
+    import os
+    import subprocess
+    import sys
+    code = ('import time; start = time.perf_counter(); import metadmodel; '
+            'elapsed = time.perf_counter() - start; import sys; '
+            f'print(elapsed, *[m for m in {_SLOW_MODULES!r} if m in sys.modules])')
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    runs = [subprocess.run([sys.executable, '-c', code], check=True,
+                           stdout=subprocess.PIPE, universal_newlines=True,
+                           cwd=cwd).stdout.split()
+            for _ in range(max(int(repeats), 1))]
+    elapsed = min(float(run[0]) for run in runs)
+    if elapsed > budget:
+        slow = runs[0][1:]
+        reason = (f'; it also imports {", ".join(slow)}' if slow else
+                  '; none of the known slow modules were imported')
+        raise ImportError(f'Importing metadmodel took {elapsed:.3f} s, over the '
+                          f'budget of {budget} s{reason}')
+    return elapsed
@@ -15,4 +15,6 @@ You should have received a copy of the GNU General Public License along with thi
 not, see http://www.gnu.org/licenses/.
 """
 
-from .simulation import Simulation
+from .exchange import (ExchangeScheme, NeighborSwaps, RepeatedNeighborSwaps,
+                       PermutationGibbs)
+from .simulation import Simulation, load_history
@@ -0,0 +1,157 @@
+"""
+This defines the exchange schemes that a System can use.
+
+A scheme is given the energies of the replicas (in replica order) and their inverse
+temperatures, and returns the new order of the walkers: replica r gets the walker
+that was at replica order[r].
+
+Copyright (C) 2018 Thomas John Heavey IV
+
+This program is free software: you can redistribute it and/or modify it under the terms of the
+GNU General Public License as published by the Free Software Foundation, either version 3 of
+the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with this program. If
+not, see http://www.gnu.org/licenses/.
+"""
+
+import itertools
+
+import numpy as np
+
+
+def inverse_temps(temps: np.ndarray) -> np.ndarray:
+    """Inverse temperatures in the units of the energies (scaled by 1e3)"""
+    return 1e3 / np.asarray(temps, dtype=float)
+
+
+def _swap_pairs(order: np.ndarray, energies: np.ndarray, betas: np.ndarray,
+                first: np.ndarray, second: np.ndarray) -> None:
+    """
+    Attempt to swap the walkers of disjoint pairs of replicas (in place)
+
+    :param order: current order of the walkers (see module docstring)
+    :param energies: energies of the walkers, in their original replica order
+    :param betas: inverse temperatures of the replicas
+    :param first: one replica of each pair
+    :param second: the other replica of each pair
+    :return: None
+    """
+    e = energies[order]
+    expo = (e[first] - e[second]) * (betas[first] - betas[second])
+    accepted = np.exp(np.minimum(expo, 0.)) > np.random.rand(len(first))
+    first, second = first[accepted], second[accepted]
+    order[first], order[second] = order[second], order[first]
+
+
+class ExchangeScheme(object):
+    """Base class for exchange schemes"""
+
+    def order(self, energies: np.ndarray, betas: np.ndarray) -> np.ndarray:
+        """
+        New order of the walkers after an exchange
+
+        :param energies: energies of the replicas
+        :param betas: inverse temperatures of the replicas
+        :return: index of the replica whose walker each replica gets
+        """
+        raise NotImplementedError
+
+
+class NeighborSwaps(ExchangeScheme):
+    """
+    Attempt to swap neighboring replicas, alternating between even and odd pairs
+
+    This is the original (default) scheme.
+    """
+
+    def __init__(self):
+        self._last_exchange_even = False
+
+    def _sweep(self, order: np.ndarray, energies: np.ndarray,
+               betas: np.ndarray) -> None:
+        """Attempt to swap every other pair of neighbors, alternating each time"""
+        offset = 1 if self._last_exchange_even else 0
+        first = np.arange(offset, len(order) - 1, 2)
+        _swap_pairs(order, energies, betas, first, first + 1)
+        self._last_exchange_even = not self._last_exchange_even
+
+    def order(self, energies: np.ndarray, betas: np.ndarray) -> np.ndarray:
+        order = np.arange(len(energies))
+        self._sweep(order, energies, betas)
+        return order
+
+
+class RepeatedNeighborSwaps(NeighborSwaps):
+    """
+    Several sweeps of neighbor swaps (alternating even and odd) per exchange
+
+    The energies do not change between the sweeps, so a walker can move several
+    replicas along the ladder in one exchange at the cost of only a few array
+    operations per sweep.
+    """
+
+    def __init__(self, sweeps: int=None):
+        """
+
+        :param sweeps: number of sweeps per exchange (default: the number of
+        replicas, enough to cross the whole ladder)
+        """
+        super().__init__()
+        self._sweeps = sweeps
+
+    def order(self, energies: np.ndarray, betas: np.ndarray) -> np.ndarray:
+        order = np.arange(len(energies))
+        for _ in range(self._sweeps or len(energies)):
+            self._sweep(order, energies, betas)
+        return order
+
+
+class PermutationGibbs(ExchangeScheme):
+    """
+    Sample the order of all of the walkers from its equilibrium distribution
+
+    This is the infinite swapping limit of exchanges (Chodera and Shirts, J. Chem.
+    Phys. 135, 194110 (2011)): for the current energies, each permutation s is
+    drawn with probability proportional to exp(- sum_r beta_r E_s(r)).
+
+    With up to max_exact replicas, this is done exactly from all permutations at
+    once. For more, the permutation is mixed with rounds of swaps between random
+    disjoint pairs of replicas (any pairs, not only neighbors), each round done
+    at once; rounds * size / 2 swaps are attempted. Each round keeps the
+    equilibrium distribution, so any number of rounds is a valid exchange; more
+    come closer to drawing the permutation independently.
+    """
+
+    def __init__(self, max_exact: int=7, rounds: int=None):
+        """
+
+        :param max_exact: largest number of replicas for exact sampling (the
+        permutations are held in an array of size! x size)
+        :param rounds: number of rounds of random pair swaps per exchange when
+        sampling is not exact (default: the number of replicas squared)
+        """
+        self._max_exact = max_exact
+        self._rounds = rounds
+        self._permutations: np.ndarray = None
+
+    def order(self, energies: np.ndarray, betas: np.ndarray) -> np.ndarray:
+        size = len(energies)
+        if size <= self._max_exact:
+            if self._permutations is None or self._permutations.shape[1] != size:
+                self._permutations = np.array(
+                    list(itertools.permutations(range(size))))
+            log_w = - (energies[self._permutations] * betas).sum(axis=1)
+            weights = np.exp(log_w - log_w.max())
+            index = np.searchsorted(np.cumsum(weights),
+                                    np.random.rand() * weights.sum())
+            return self._permutations[min(index, len(weights) - 1)].copy()
+        order = np.arange(size)
+        for _ in range(self._rounds or size**2):
+            pairs = np.random.permutation(size)[:size - size % 2]
+            _swap_pairs(order, energies, betas, pairs[0::2], pairs[1::2])
+        return order
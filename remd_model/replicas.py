@@ -54,3 +54,10 @@ class Replicas(object):
         for walker, temp, index in zip(self.replicas[indexer], temps, indexer):
             walker.temp = temp
             walker.r_index = index
+
+    def permute(self, order: np.ndarray):
+        """Move the walker at replica order[r] to replica r, for every r"""
+        order = np.asarray(order)
+        self.w_indexes = self.w_indexes[order]
+        for index in np.nonzero(order != np.arange(self.size))[0]:
+            self.walkers[self.w_indexes[index]].move_to(index, self.temps[index])
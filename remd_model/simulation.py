@@ -17,6 +17,7 @@ not, see http://www.gnu.org/licenses/.
 
 import numpy as np
 
+from .exchange import ExchangeScheme
 from .system import System
 
 
@@ -24,21 +25,77 @@ class Simulation(object):
 
     def __init__(self, size: int, n_steps: int, interval: int,
                  start_temp: float=300., scaling_exponent: float=0.05,
-                 width_param: float=5.):
+                 width_param: float=5., exchange_scheme: ExchangeScheme=None):
         self.size = size
         self.n_steps = n_steps
         self.interval = interval
         self.system = System(size, start_temp=start_temp,
                              scaling_exponent=scaling_exponent,
-                             width_param=width_param)
+                             width_param=width_param,
+                             exchange_scheme=exchange_scheme)
         self.energies = np.zeros((n_steps, size), dtype=float)
         self.w_states = np.zeros((n_steps, size), dtype=int)
         self.r_states = np.zeros((n_steps, size), dtype=int)
 
+    @property
+    def history_dtype(self) -> np.dtype:
+        index_type = np.min_scalar_type(self.size)
+        return np.dtype([('energies', float, (self.size,)),
+                         ('w_states', index_type, (self.size,)),
+                         ('r_states', index_type, (self.size,))])
+
+    def save_history(self, path: str):
+        """
+        Save energies and states of every step to a binary (.npy) file
+
+        One record per step, with the states in the smallest integer type that
+        can hold them. Read it back (or memory-map it) with load_history.
+        """
+        history = np.empty(self.n_steps, dtype=self.history_dtype)
+        history['energies'] = self.energies
+        history['w_states'] = self.w_states
+        history['r_states'] = self.r_states
+        np.save(path, history)
+
+    def load_history(self, path: str):
+        history = load_history(path, mmap_mode=None)
+        if history.shape != (self.n_steps,) or history.dtype != self.history_dtype:
+            raise ValueError(f'History in {path} does not match this simulation '
+                             f'({self.n_steps} steps of {self.size} replicas)')
+        self.energies = history['energies'].astype(float)
+        self.w_states = history['w_states'].astype(int)
+        self.r_states = history['r_states'].astype(int)
+
     def run(self):
-        for i in range(self.n_steps):
-            self.energies[i] = self.system.energies
-            self.w_states[i] = self.system.w_state
-            self.r_states[i] = self.system.r_state
+        self.energies[:], self.w_states[:], self.r_states[:] = \
+            self.run_steps(0, self.n_steps)
+
+    def run_steps(self, start: int, stop: int) -> tuple:
+        """
+        Run steps start to stop - 1 and return their energies and states
+
+        This does not store anything in the simulation's arrays, so that blocks of
+        steps can be run elsewhere (e.g. in another process) and put together.
+        """
+        energies = np.zeros((stop - start, self.size), dtype=float)
+        w_states = np.zeros((stop - start, self.size), dtype=int)
+        r_states = np.zeros((stop - start, self.size), dtype=int)
+        for i in range(start, stop):
+            energies[i - start] = self.system.energies
+            w_states[i - start] = self.system.w_state
+            r_states[i - start] = self.system.r_state
             if ((i+1) % self.interval) == 0:
                 self.system.exchange()
+        return energies, w_states, r_states
+
+
+def load_history(path: str, mmap_mode: str='r') -> np.ndarray:
+    """
+    Load a history saved by Simulation.save_history
+
+    :param path: file to read
+    :param mmap_mode: as for np.load; by default the file is memory-mapped, use
+        None to read it all into memory
+    :return: structured array with fields energies, w_states, and r_states
+    """
+    return np.load(path, mmap_mode=mmap_mode)
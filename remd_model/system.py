@@ -16,6 +16,7 @@ not, see http://www.gnu.org/licenses/.
 """
 
 import numpy as np
+from .exchange import ExchangeScheme, NeighborSwaps, inverse_temps
 from .replicas import Replicas
 
 
@@ -23,13 +24,13 @@ class System(object):
 
     def __init__(self, size: int,
                  start_temp: float=300., scaling_exponent: float=0.05,
-                 width_param=5):
+                 width_param=5, exchange_scheme: ExchangeScheme=None):
         self.size = size
         self.replicas = Replicas(size,
                                  start_temp=start_temp,
                                  scaling_exponent=scaling_exponent,
                                  width_param=width_param)
-        self._last_exchange_even = False
+        self.exchange_scheme = exchange_scheme or NeighborSwaps()
 
     @property
     def w_state(self) -> np.ndarray:
@@ -44,18 +45,6 @@ class System(object):
         return np.array(list((r.energy for r in self.replicas)))
 
     def exchange(self) -> None:
-        energies = self.energies
-        temps = self.replicas.temps
-        offset = 1 if self._last_exchange_even else 0
-        n = int(np.floor((self.size - offset) / 2.))
-        probs = np.zeros(n, dtype=float)
-        rands = np.random.rand(n)
-        for i in range(n):
-            ind = 2 * i + offset
-            expo = ((energies[ind] - energies[ind+1]) *
-                    (1 / temps[ind] - 1 / temps[ind+1]) *
-                    1e3)
-            probs[i] = min(1, np.exp(expo))
-            if probs[i] > rands[i]:
-                self.replicas.exchange(ind)
-        self._last_exchange_even = not self._last_exchange_even
+        order = self.exchange_scheme.order(self.energies,
+                                           inverse_temps(self.replicas.temps))
+        self.replicas.permute(order)
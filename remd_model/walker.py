@@ -49,6 +49,11 @@ class Walker(object):
                              f'Old: {self._r_index}. New: {val}')
         self._r_index = val
 
+    def move_to(self, r_index: int, temp: float):
+        """Move to any replica (e.g. after an exchange of many replicas)"""
+        self._r_index = r_index
+        self.temp = temp
+
     def __repr__(self) -> str:
         return (f'{self.__class__} with w_index {self.w_index} '
                 f'and r_index {self.r_index}')